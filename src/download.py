@@ -1,184 +1,713 @@
-"""
-Módulo para descargar y cargar datos de la base 'Quién es Quién en los Precios' (Profeco).
-"""
-
-from src.config import BASE, DATA, RAW
-from src.utils.loggin_config import get_logger
-
-import time
-import datetime
-import re
-import rarfile
-import json
-import argparse
-from pathlib import Path
-from hashlib import md5
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-
-
-import requests
-import tqdm
-from bs4 import BeautifulSoup
-
-
-# loggin config
-logger = get_logger(__name__)
-
-URL_BASE = "https://datos.profeco.gob.mx/datos_abiertos/qqp.php"
-URL_DOWNLOAD_ROOT = "https://datos.profeco.gob.mx/datos_abiertos/"
-# URL_TEST = "https://datos.profeco.gob.mx/lol-no-existe"
-
-
-def get_file_links():
-    dict_links = {} 
-    responce = requests.get(URL_BASE)
-    if responce.status_code == 200: 
-        soup = BeautifulSoup(responce.content, features='html.parser')
-        for link in soup.find_all('a', href=True): 
-            text = link.get_text(strip=True)
-            href = link['href']
-            match = re.search(r"\b(20\d{2})\b", text)
-            if match: 
-                year = match.group(1)
-                dict_links[year] = URL_DOWNLOAD_ROOT+"/"+href
-    else: 
-        logger.critical("Responce error. ")
-        return {}
-    return dict_links
-
-def check_existing(years, path=RAW):
-    missing = []
-    existing = []
-    existing_files = [f.name for f in path.iterdir()
-                      if (f.is_file() and 
-                          f.suffix in {'.rar', '.RAR', '.zip', '.ZIP'})]
-    
-    for y in years: 
-        if any(str(y) in name for name in existing_files): 
-            logger.info(f'Year {y}.zip already exists in {path.relative_to(BASE)}, skipping...\n')
-            existing.append(y)
-        else: 
-            missing.append(y)
-    
-    return missing, existing
-
-def is_valid_rar(file_path):
-    try:
-        with rarfile.RarFile(file_path, "r") as rf:
-            rf.testrar()
-        return True
-    except rarfile.Error as e:
-        logger.error(f"Invalid rar file: {file_path} ({e})")
-        return False
-    
-def generate_download_metadata(filename, file_path, url, hash_value, is_valid_rar, download_time):
-    metadata_dir = RAW / "metadata_download"
-    metadata_dir.mkdir(exist_ok=True) 
-    # logger.debug(f'{metadata_dir}: {metadata_dir.exists()}') OK
-
-    metadata = {
-        'filename': filename, 
-        'path': str(file_path),
-        'url': url, 
-        'date_downloaded': datetime.now().isoformat(), 
-        'hash': hash_value,
-        'file_size_actual': file_path.stat().st_size, 
-        'valid': is_valid_rar, 
-        'elapsed_time': download_time
-    }
-
-    # guardar metadatos en data/raw/metadata_download
-    metadata_file = metadata_dir / f"{filename}.json"
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, indent=4, ensure_ascii=False)  # OK
-    
-
-def download_file(url, path=RAW):
-    response = requests.get(url, stream=True) 
-
-    # Get filename
-    if "content-disposition" in response.headers:
-        content_disposition = response.headers["content-disposition"]
-        filename = content_disposition.split("filename=")[-1]
-    else:
-        filename = url.split("/")[-1]
-
-    file_path = path / filename
-    hash_object = md5()
-    chunk_size = 10*1024*1024  # 10 MB
-    start = time.time()
-        
-    # download by chunks
-    with open(file_path, "wb") as f:
-        # print(f"Downloading {filename}: ", end="", flush=True)
-        for chunk in response.iter_content(chunk_size=chunk_size):
-            if chunk:
-                f.write(chunk)
-                hash_object.update(chunk)
-                # print("|", end="", flush=True)  # imprime barra por cada chunk
-        print()
-
-    elapsed = time.time() - start
-
-    # Validate file
-    if not is_valid_rar(file_path):
-            logger.warning(f'Incomplete download for {file_path.name}, retrying...')
-            file_path.unlink(missing_ok=True)  # eliminar incompleto
-            return download_file(url, path)  # reintento
-
-    _ = generate_download_metadata(
-        filename=filename,
-        file_path=file_path.relative_to(BASE),
-        url=url,
-        hash_value=hash_object.hexdigest(),
-        is_valid_rar=is_valid_rar(file_path),
-        download_time=elapsed
-    )
-
-    if file_path.is_file(): 
-        logger.info(f"Data downloaded at: {file_path.relative_to(BASE)} in {elapsed:.1}s\n")
-        
-    return file_path
-
-def download_files(urls, downloader=download_file): 
-    with ThreadPoolExecutor(max_workers=3) as executor: 
-        executor.map(downloader, urls)
-
-def run_downloader(years=None, path=RAW): 
-    """
-    Descarga los datos de para los años indicados. 
-    Si `years` es None, intenta descargar todos los disponibles. 
-    """
-    links_dic = get_file_links()
-    # for k, v in links.items(): logger.debug(f"{k}: {v}")  # OK
-    # if not links: 
-    #     logger.debug("LOL, NO LINKS")
-    #     return 
-    
-    if years: 
-        selected_years = (year for year in years if year in links_dic)
-    # logger.debug(str(selected_years))  # OK
-
-    years_to_download, _ = check_existing(selected_years)
-    # logger.debug(years_to_download)  # OK
-    
-    links = (links_dic[y] for y in years_to_download)
-    # for l in links: logger.debug(l)  # OK
-    
-    if links:
-        start = datetime.now()
-        logger.info(f'Start download process at: {start.isoformat()})\n') 
-        download_files(links)
-        end = datetime.now()
-        logger.info(f'End download process at: {end.isoformat()}')
-    else:
-        logger.info('All year files are already downloaded. ')
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="Descargar datos de Profeco por año")
-    parser.add_argument(
-        "-y", "--years", nargs="+", help="Lista de años a descargar (ej: 2021 2022 2023)"
-    )
-    args = parser.parse_args()
-    run_downloader(years=args.years)
+"""
+Módulo para descargar y cargar datos de la base 'Quién es Quién en los Precios' (Profeco).
+"""
+
+from src.config import BASE, DATA, RAW
+from src.utils.loggin_config import get_logger
+from src.utils.http import make_session, get_session
+from src.utils.retry import RetryPolicy, StallError, TransferStats
+from src.utils.manifest import open_manifest
+
+import os
+import time
+import threading
+import datetime
+import re
+import html
+import rarfile
+import json
+import argparse
+from pathlib import Path
+from hashlib import md5
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+import requests
+import tqdm
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+# loggin config
+logger = get_logger(__name__)
+
+URL_BASE = "https://datos.profeco.gob.mx/datos_abiertos/qqp.php"
+URL_DOWNLOAD_ROOT = "https://datos.profeco.gob.mx/datos_abiertos/"
+DOWNLOAD_WORKERS = 3
+CHUNK_SIZE = 10*1024*1024  # 10 MB
+READ_BLOCK = 64*1024  # lectura del socket: el detector de estancamiento mide cada bloque
+PART_SUFFIX = ".part"
+LINKS_TTL = 6 * 60 * 60  # segundos
+YEAR_PATTERN = re.compile(r"\b(20\d{2})\b")
+ANCHOR_PATTERN = re.compile(
+    r"""<a\s[^>]*?href\s*=\s*["']([^"']+)["'][^>]*>(.*?)</a\s*>""", re.IGNORECASE | re.DOTALL
+)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+_legacy_import_lock = threading.Lock()
+_legacy_imported = set()
+RAR_SIGNATURES = (b"Rar!\x1a\x07\x00", b"Rar!\x1a\x07\x01\x00")  # RAR4, RAR5
+# URL_TEST = "https://datos.profeco.gob.mx/lol-no-existe"
+
+
+def _parse_file_links_soup(content):
+    dict_links = {} 
+    soup = BeautifulSoup(content, features='html.parser', parse_only=SoupStrainer('a', href=True))
+    for link in soup.find_all('a', href=True): 
+        text = link.get_text(strip=True)
+        href = link['href']
+        match = YEAR_PATTERN.search(text)
+        if match: 
+            year = match.group(1)
+            dict_links[year] = URL_DOWNLOAD_ROOT+"/"+href
+    return dict_links
+
+def parse_file_links(content):
+    """
+    Extrae {año: url} de la página de Profeco. Recorre los <a> con una expresión regular
+    y solo recurre a BeautifulSoup si no encuentra nada (HTML inesperado).
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+
+    dict_links = {} 
+    for href, inner in ANCHOR_PATTERN.findall(content):
+        text = html.unescape(TAG_PATTERN.sub('', inner)).strip()
+        match = YEAR_PATTERN.search(text)
+        if match: 
+            dict_links[match.group(1)] = URL_DOWNLOAD_ROOT+"/"+html.unescape(href)
+    return dict_links or _parse_file_links_soup(content)
+
+def load_links_cache():
+    cache_file = RAW / "links_cache.json"
+    if not cache_file.exists():
+        return None
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_links_cache(links, etag=None, last_modified=None):
+    cache_file = RAW / "links_cache.json"
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    cache = {
+        'fetched_at': time.time(),
+        'etag': etag,
+        'last_modified': last_modified,
+        'links': links,
+    }
+    tmp_file = cache_file.with_suffix(".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+    return cache
+
+def is_links_cache_fresh(cache, ttl=LINKS_TTL):
+    return bool(cache and cache.get('links')) and time.time() - cache.get('fetched_at', 0) < ttl
+
+def get_file_links(session=None, ttl=LINKS_TTL, refresh=False):
+    """
+    Regresa {año: url}. Usa el caché en disco mientras tenga menos de `ttl` segundos; 
+    después revalida con If-None-Match / If-Modified-Since y solo vuelve a parsear
+    la página si cambió.
+    """
+    cache = load_links_cache()
+    if not refresh and is_links_cache_fresh(cache, ttl):
+        return cache['links']
+
+    session = session or get_session()
+    headers = conditional_headers(cache) if cache and not refresh else {}
+    responce = session.get(URL_BASE, headers=headers)
+    if responce.status_code == 304: 
+        logger.info('Profeco link index unchanged, reusing cache.\n')
+        return save_links_cache(cache['links'], cache.get('etag'), cache.get('last_modified'))['links']
+    elif responce.status_code == 200: 
+        links = parse_file_links(responce.content)
+        save_links_cache(links, responce.headers.get('etag'), responce.headers.get('last-modified'))
+        return links
+    elif cache and cache.get('links'): 
+        logger.warning(f'Responce error {responce.status_code}, using stale link cache.\n')
+        return cache['links']
+    else: 
+        logger.critical("Responce error. ")
+        return {}
+
+def download_manifest():
+    """
+    Manifiesto único de descargas en data/raw/manifest_download.jsonl, indexado por
+    url, año y hash. La primera vez importa los JSON sueltos de `metadata_download/`.
+    """
+    manifest = open_manifest(RAW / "manifest_download.jsonl", indexes=('url', 'year', 'hash'))
+    legacy_dir = RAW / "metadata_download"
+    with _legacy_import_lock:
+        if manifest.path in _legacy_imported:
+            return manifest
+        _legacy_imported.add(manifest.path)
+        if len(manifest) or not legacy_dir.exists():
+            return manifest
+        for metadata_file in sorted(legacy_dir.glob("*.json")):
+            with open(metadata_file, encoding='utf-8') as f:
+                metadata = json.load(f)
+            metadata.setdefault('year', get_year(metadata.get('filename', '')))
+            manifest.append(metadata)
+        logger.info(f'Imported {len(manifest)} legacy metadata files into {manifest.path.name}\n')
+    return manifest
+
+def get_year(string):
+    match = re.search(r"(20\d{2})", str(string))
+    return match.group(1) if match else None
+
+def load_download_metadata(url):
+    return download_manifest().get('url', url)
+
+def _response_validators(response):
+    content_length = response.headers.get("content-length")
+    total = response.headers.get("content-range", "").rpartition("/")[-1]
+    if total.isdigit():
+        content_length = total
+    return {
+        'etag': response.headers.get("etag"),
+        'last_modified': response.headers.get("last-modified"),
+        'content_length': int(content_length) if content_length else None,
+    }
+
+def conditional_headers(metadata):
+    headers = {}
+    if metadata.get('etag'):
+        headers['If-None-Match'] = metadata['etag']
+    if metadata.get('last_modified'):
+        headers['If-Modified-Since'] = metadata['last_modified']
+    return headers
+
+def validators_match(metadata, remote):
+    for key in ('etag', 'last_modified', 'content_length'):
+        if metadata.get(key) and remote[key]:
+            return metadata[key] == remote[key]
+    return False
+
+def is_unchanged(url, metadata, session=None):
+    """
+    Pregunta al servidor si el archivo descargado sigue vigente. 
+    Usa If-None-Match / If-Modified-Since y, si no hay 304, compara ETag, 
+    Last-Modified y Content-Length del HEAD contra los metadatos guardados.
+    """
+    session = session or get_session()
+    response = session.head(url, headers=conditional_headers(metadata), allow_redirects=True)
+    if response.status_code == 304:
+        return True
+    if response.status_code != 200:
+        logger.warning(f'HEAD {url} returned {response.status_code}, assuming changed.\n')
+        return False
+
+    return validators_match(metadata, _response_validators(response))
+
+def check_existing(years, links, path=RAW, session=None):
+    missing = []
+    existing = []
+
+    for y in years: 
+        url = links[y]
+        metadata = load_download_metadata(url)
+        file_path = BASE / metadata['path'] if metadata else None
+
+        if not (file_path and file_path.is_file()):
+            missing.append(y)
+        elif metadata.get('content_length') not in (None, file_path.stat().st_size):
+            logger.warning(f'{file_path.name} is incomplete, downloading again...\n')
+            missing.append(y)
+        elif is_unchanged(url, metadata, session):
+            logger.info(f'Year {y} is up to date in {path.relative_to(BASE)}, skipping...\n')
+            existing.append(y)
+        else:
+            logger.info(f'Year {y} changed upstream, downloading again...\n')
+            missing.append(y)
+    
+    return missing, existing
+
+def is_valid_rar(file_path):
+    try:
+        with rarfile.RarFile(file_path, "r") as rf:
+            rf.testrar()
+        return True
+    except rarfile.Error as e:
+        logger.error(f"Invalid rar file: {file_path} ({e})")
+        return False
+    
+class InvalidArchiveError(Exception):
+    """El servidor respondió algo que no es un archivo RAR."""
+
+def has_rar_signature(head):
+    return any(head.startswith(signature) for signature in RAR_SIGNATURES)
+
+def is_structurally_valid(file_path, expected_size=None):
+    """Chequeo barato: firma RAR al inicio y tamaño igual al Content-Length anunciado."""
+    with open(file_path, 'rb') as f:
+        head = f.read(8)
+    if not has_rar_signature(head):
+        logger.error(f"Missing RAR signature: {file_path}")
+        return False
+    if expected_size is not None and file_path.stat().st_size != expected_size:
+        logger.error(f"Size mismatch for {file_path}: {file_path.stat().st_size} != {expected_size}")
+        return False
+    return True
+
+def load_cached_validation(hash_value):
+    metadata = download_manifest().get('hash', hash_value)
+    if metadata and metadata.get('validation') == 'full':
+        return metadata['valid']
+    return None
+
+def validate_download(file_path, hash_value, expected_size=None, verify='auto'):
+    """
+    Valida un archivo descargado una sola vez. Regresa (valid, validation).
+    
+    Siempre corre el chequeo estructural. El CRC completo (`testrar`) solo corre con
+    `verify='full'` o cuando no hay Content-Length para confirmar que el archivo está
+    completo, y su resultado se reutiliza para cualquier archivo con el mismo hash.
+    """
+    if not is_structurally_valid(file_path, expected_size):
+        return False, 'structural'
+    if verify != 'full' and expected_size is not None:
+        return True, 'structural'
+
+    cached = load_cached_validation(hash_value)
+    if cached is not None:
+        logger.info(f'Reusing full validation of {file_path.name} (hash {hash_value})\n')
+        return cached, 'full'
+    return is_valid_rar(file_path), 'full'
+
+def generate_download_metadata(filename, file_path, url, hash_value, is_valid_rar, download_time, 
+                               etag=None, last_modified=None, content_length=None, validation=None,
+                               attempts=1, wasted_bytes=0):
+    metadata = {
+        'year': get_year(filename),
+        'filename': filename, 
+        'path': str(file_path),
+        'url': url, 
+        'date_downloaded': datetime.now().isoformat(), 
+        'hash': hash_value,
+        'file_size_actual': (BASE / file_path).stat().st_size, 
+        'valid': is_valid_rar, 
+        'validation': validation,
+        'elapsed_time': download_time,
+        'attempts': attempts,
+        'wasted_bytes': wasted_bytes,
+        'etag': etag,
+        'last_modified': last_modified,
+        'content_length': content_length,
+    }
+
+    # una línea por descarga en data/raw/manifest_download.jsonl
+    return download_manifest().append(metadata)
+    
+
+def _filename_from_response(response, url):
+    if "content-disposition" in response.headers:
+        content_disposition = response.headers["content-disposition"]
+        return content_disposition.split("filename=")[-1].strip('"')
+    return url.split("/")[-1]
+
+def _partial_paths(url, path=RAW):
+    name = url.split("/")[-1]
+    return path / f"{name}{PART_SUFFIX}", path / f"{name}{PART_SUFFIX}.json"
+
+def _write_sidecar(sidecar_path, state):
+    tmp_path = sidecar_path.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, sidecar_path)
+
+def _drop_partial(part_path, sidecar_path):
+    part_path.unlink(missing_ok=True)
+    sidecar_path.unlink(missing_ok=True)
+
+def _load_partial(url, part_path, sidecar_path, stats=None):
+    """
+    Recupera el estado de una descarga interrumpida. 
+    Regresa (bytes_escritos, hash, validador) o (0, md5(), None) si no hay nada que reanudar.
+    """
+    if not (part_path.is_file() and sidecar_path.is_file()):
+        _drop_partial(part_path, sidecar_path)
+        return 0, md5(), None
+
+    try:
+        with open(sidecar_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    offset = state.get('bytes_written', 0)
+    if state.get('url') != url or offset <= 0 or part_path.stat().st_size < offset:
+        _drop_partial(part_path, sidecar_path)
+        return 0, md5(), None
+
+    # md5 no es serializable: se recalcula el prefijo local y se compara con el sidecar
+    hash_object = md5()
+    with open(part_path, 'r+b') as f:
+        f.truncate(offset)
+        while block := f.read(CHUNK_SIZE):
+            hash_object.update(block)
+
+    if hash_object.hexdigest() != state.get('hash'):
+        logger.warning(f'Partial file {part_path.name} does not match its sidecar, restarting.\n')
+        if stats:
+            stats.waste(offset)
+        _drop_partial(part_path, sidecar_path)
+        return 0, md5(), None
+
+    return offset, hash_object, state.get('validator')
+
+def _content_range_start(response):
+    match = re.match(r"bytes (\d+)-", response.headers.get("content-range", ""))
+    return int(match.group(1)) if match else None
+
+def _content_range_total(response):
+    total = response.headers.get("content-range", "").rpartition("/")[-1]
+    return int(total) if total.isdigit() else None
+
+def _stream_to_part(url, part_path, sidecar_path, session, policy, stats, resume=True):
+    """
+    Descarga `url` en un solo flujo hacia `part_path`, reanudando con Range si hay un parcial.
+    Regresa (filename, hash_object, validators).
+    """
+    offset, hash_object, validator = (
+        _load_partial(url, part_path, sidecar_path, stats) if resume else (0, md5(), None)
+    )
+
+    headers = {}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        if validator:
+            # si el archivo cambió en el servidor, If-Range hace que responda 200 completo
+            headers['If-Range'] = validator
+
+    response = session.get(url, stream=True, headers=headers, timeout=policy.timeout)
+
+    # 416 con `bytes */N` y N == offset: el corte fue justo al final, el parcial ya está completo
+    if offset and response.status_code == 416 and _content_range_total(response) == offset:
+        logger.info(f'{part_path.name} was already complete at {offset} bytes\n')
+        response.close()
+        return _filename_from_response(response, url), hash_object, _response_validators(response)
+    # un error (503, 416...) no significa que el servidor ignore Range: el parcial se conserva
+    response.raise_for_status()
+
+    if offset and response.status_code == 206 and _content_range_start(response) == offset:
+        logger.info(f'Resuming {part_path.name} from byte {offset}\n')
+    elif offset:
+        logger.warning(f'Server ignored Range for {url}, downloading from scratch.\n')
+        stats.waste(offset)
+        offset, hash_object = 0, md5()
+
+    filename = _filename_from_response(response, url)
+    validators = _response_validators(response)
+    validator = validators['etag'] or validators['last_modified']
+
+    # se lee en bloques chicos y se escribe por lotes de CHUNK_SIZE
+    stall = policy.stall_detector()
+    pending = bytearray()
+    with open(part_path, "r+b" if offset else "wb") as f:
+        f.truncate(offset)
+        f.seek(offset)
+
+        def flush():
+            nonlocal offset
+            if not pending:
+                return
+            f.write(pending)
+            hash_object.update(pending)
+            offset += len(pending)
+            pending.clear()
+            if resume:
+                f.flush()
+                _write_sidecar(sidecar_path, {
+                    'url': url,
+                    'bytes_written': offset,
+                    'hash': hash_object.hexdigest(),
+                    'validator': validator,
+                })
+
+        try:
+            for block in response.iter_content(chunk_size=READ_BLOCK):
+                if block:
+                    if offset == 0 and not pending and not has_rar_signature(block):
+                        raise InvalidArchiveError(f'{url} did not return a RAR archive')
+                    pending += block
+                    if len(pending) >= CHUNK_SIZE:
+                        flush()
+                    stall.update(len(block))
+        except (requests.exceptions.RequestException, StallError):
+            # lo recibido queda en el parcial y el siguiente intento reanuda desde ahí;
+            # sin `resume` se vuelve a empezar y todo lo de este intento se pierde
+            flush()
+            if not resume:
+                stats.waste(offset)
+            raise
+        flush()
+
+    return filename, hash_object, validators
+
+def _split_ranges(size, segments):
+    step = -(-size // segments)  # ceil
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+def _fetch_segment(session, url, fd, start, end, policy, stats, validator=None):
+    headers = {'Range': f'bytes={start}-{end}'}
+    if validator:
+        headers['If-Range'] = validator
+    response = session.get(url, stream=True, headers=headers, timeout=policy.timeout)
+
+    if response.status_code != 206 or _content_range_start(response) != start:
+        raise requests.exceptions.HTTPError(
+            f'Expected 206 for bytes {start}-{end}, got {response.status_code}'
+        )
+
+    pos = start
+    stall = policy.stall_detector()
+    try:
+        for chunk in response.iter_content(chunk_size=READ_BLOCK):
+            if chunk:
+                os.pwrite(fd, chunk, pos)
+                pos += len(chunk)
+                stall.update(len(chunk))
+    except (requests.exceptions.RequestException, StallError):
+        # el segmento se vuelve a pedir completo
+        stats.waste(pos - start)
+        raise
+
+    if pos != end + 1:
+        raise requests.exceptions.ChunkedEncodingError(
+            f'Segment {start}-{end} ended at byte {pos}'
+        )
+    return start, end
+
+def _load_segments_done(url, part_path, sidecar_path, size, validator, resume=True):
+    if not (resume and part_path.is_file() and sidecar_path.is_file()):
+        return set()
+    try:
+        with open(sidecar_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if (state.get('url'), state.get('size'), state.get('validator')) != (url, size, validator):
+        return set()
+    return {tuple(r) for r in state.get('segments_done', [])}
+
+def _segments_to_part(url, part_path, sidecar_path, segments, session, policy, stats, resume=True):
+    """
+    Descarga `url` en `segments` rangos concurrentes escritos con pwrite sobre un archivo
+    preasignado. Regresa (filename, hash_object, validators), o None si el servidor no soporta Range.
+    """
+    head = session.head(url, allow_redirects=True, timeout=policy.timeout)
+    size = int(head.headers.get("content-length", 0))
+    if head.status_code != 200 or size <= 0 or head.headers.get("accept-ranges") != "bytes":
+        logger.warning(f'{url} does not support byte ranges, using a single stream.\n')
+        return None
+
+    filename = _filename_from_response(head, url)
+    validators = _response_validators(head)
+    validator = validators['etag'] or validators['last_modified']
+
+    done = _load_segments_done(url, part_path, sidecar_path, size, validator, resume)
+
+    pending = [r for r in _split_ranges(size, segments) if r not in done]
+    if done:
+        logger.info(f'Resuming {part_path.name}: {len(pending)} of {segments} segments left\n')
+
+    with open(part_path, "r+b" if done else "w+b") as f:
+        if not done:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                f.truncate(size)
+
+        def save_done():
+            if resume:
+                _write_sidecar(sidecar_path, {
+                    'url': url,
+                    'size': size,
+                    'validator': validator,
+                    'segments_done': sorted(done),
+                })
+
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            futures = [executor.submit(_fetch_segment, session, url, f.fileno(), start, end,
+                                       policy, stats, validator)
+                       for start, end in pending]
+            try:
+                for future in as_completed(futures):
+                    done.add(future.result())
+                    save_done()
+            except (requests.exceptions.RequestException, StallError):
+                for future in futures:
+                    future.cancel()
+                # los segmentos que terminan después del error también quedan para el siguiente intento
+                for future in futures:
+                    if not future.cancelled() and future.exception() is None:
+                        done.add(future.result())
+                save_done()
+                raise
+
+        # md5 no se puede combinar por segmentos: se calcula en orden al final
+        f.seek(0)
+        hash_object = md5()
+        while block := f.read(CHUNK_SIZE):
+            hash_object.update(block)
+
+    return filename, hash_object, validators
+
+def download_file(url, path=RAW, resume=True, segments=1, session=None, verify='auto', policy=None):
+    session = session or get_session()
+    policy = policy or RetryPolicy()
+    stats = TransferStats()
+    part_path, sidecar_path = _partial_paths(url, path)
+    start = time.time()
+
+    while stats.attempts < policy.max_attempts:
+        stats.attempts += 1
+        if stats.attempts > 1:
+            delay = policy.delay(stats.attempts - 1)
+            logger.info(f'Retrying {part_path.name} in {delay:.1f}s '
+                        f'(attempt {stats.attempts}/{policy.max_attempts})\n')
+            time.sleep(delay)
+
+        try:
+            result = None
+            if segments > 1:
+                result = _segments_to_part(url, part_path, sidecar_path, segments, session,
+                                           policy, stats, resume)
+                if result is None:
+                    _drop_partial(part_path, sidecar_path)
+            if result is None:
+                result = _stream_to_part(url, part_path, sidecar_path, session, policy, stats, resume)
+        except (requests.exceptions.RequestException, StallError) as e:
+            # el parcial se conserva: el siguiente intento reanuda
+            logger.warning(f'Connection lost for {part_path.name} ({e})\n')
+            continue
+        except InvalidArchiveError as e:
+            logger.error(f'{e}, skipping.\n')
+            _drop_partial(part_path, sidecar_path)
+            return None
+
+        filename, hash_object, validators = result
+        file_path = path / filename
+        os.replace(part_path, file_path)
+        sidecar_path.unlink(missing_ok=True)
+
+        # Validate file (una sola vez; el resultado queda en los metadatos)
+        hash_value = hash_object.hexdigest()
+        valid, validation = validate_download(file_path, hash_value, validators['content_length'], verify)
+        if valid:
+            break
+        logger.warning(f'Incomplete download for {file_path.name}, retrying...')
+        stats.waste(file_path.stat().st_size)
+        file_path.unlink(missing_ok=True)  # eliminar incompleto
+    else:
+        logger.error(f'Giving up on {url} after {stats.attempts} attempts '
+                     f'({stats.wasted_bytes} bytes wasted)\n')
+        return None
+
+    elapsed = time.time() - start
+    _ = generate_download_metadata(
+        filename=filename,
+        file_path=file_path.relative_to(BASE),
+        url=url,
+        hash_value=hash_value,
+        is_valid_rar=valid,
+        download_time=elapsed,
+        validation=validation,
+        **validators,
+        **stats.as_dict()
+    )
+
+    if file_path.is_file(): 
+        logger.info(f"Data downloaded at: {file_path.relative_to(BASE)} in {elapsed:.1}s\n")
+        
+    return file_path
+
+def download_files(urls, downloader=download_file, path=RAW, segments=1, session=None, verify='auto',
+                   policy=None): 
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor: 
+        executor.map(partial(downloader, path=path, segments=segments, session=session,
+                             verify=verify, policy=policy), urls)
+
+def run_downloader(years=None, path=RAW, segments=1, engine='thread', verify='auto', policy=None,
+                   refresh_links=False, concurrency=None): 
+    """
+    Descarga los datos de para los años indicados. 
+    Si `years` es None, intenta descargar todos los disponibles. 
+    `engine='async'` usa el motor asyncio de `src.download_async` en lugar de hilos; 
+    `concurrency` limita sus transferencias simultáneas (None = MAX_CONCURRENCY).
+    """
+    if engine == 'async':
+        import asyncio
+        from src.download_async import run_downloader_async, MAX_CONCURRENCY
+        return asyncio.run(run_downloader_async(years, path, segments, concurrency=concurrency or MAX_CONCURRENCY,
+                                                verify=verify, policy=policy, refresh_links=refresh_links))
+
+    # una sola sesión: el pool cubre todos los workers y sus segmentos
+    session = make_session(pool_size=DOWNLOAD_WORKERS * max(segments, 1))
+    links_dic = get_file_links(session, refresh=refresh_links)
+    # for k, v in links.items(): logger.debug(f"{k}: {v}")  # OK
+    # if not links: 
+    #     logger.debug("LOL, NO LINKS")
+    #     return 
+    
+    if years: 
+        selected_years = [year for year in years if year in links_dic]
+    else: 
+        selected_years = list(links_dic)
+    # logger.debug(str(selected_years))  # OK
+
+    years_to_download, _ = check_existing(selected_years, links_dic, path, session)
+    # logger.debug(years_to_download)  # OK
+    
+    links = [links_dic[y] for y in years_to_download]
+    # for l in links: logger.debug(l)  # OK
+    
+    if links:
+        start = datetime.now()
+        logger.info(f'Start download process at: {start.isoformat()})\n') 
+        download_files(links, path=path, segments=segments, session=session, verify=verify, policy=policy)
+        end = datetime.now()
+        logger.info(f'End download process at: {end.isoformat()}')
+    else:
+        logger.info('All year files are already downloaded. ')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Descargar datos de Profeco por año")
+    parser.add_argument(
+        "-y", "--years", nargs="+", help="Lista de años a descargar (ej: 2021 2022 2023)"
+    )
+    parser.add_argument(
+        "-s", "--segments", type=int, default=1,
+        help="Rangos concurrentes por archivo (ej: -s 4); 1 descarga en un solo flujo"
+    )
+    parser.add_argument(
+        "-e", "--engine", choices=["thread", "async"], default="thread",
+        help="Motor de descarga: hilos (por defecto) o asyncio (requiere aiohttp)"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=None,
+        help="Con -e async: transferencias simultáneas en total, años más segmentos (por defecto 32)"
+    )
+    parser.add_argument(
+        "--verify", choices=["auto", "full"], default="auto",
+        help="auto: firma y tamaño, CRC completo solo si falta Content-Length; full: siempre testrar"
+    )
+    parser.add_argument(
+        "--max-attempts", type=int, default=RetryPolicy.max_attempts,
+        help="Intentos máximos por archivo antes de rendirse"
+    )
+    parser.add_argument(
+        "--min-throughput", type=int, default=RetryPolicy.min_throughput,
+        help="Bytes/s mínimos antes de abortar y reanudar una transferencia estancada (0 lo desactiva)"
+    )
+    parser.add_argument(
+        "--refresh-links", action="store_true",
+        help="Ignora el caché de ligas y vuelve a consultar la página de Profeco"
+    )
+    args = parser.parse_args()
+    policy = RetryPolicy(max_attempts=args.max_attempts, min_throughput=args.min_throughput)
+    run_downloader(years=args.years, segments=args.segments, engine=args.engine, verify=args.verify,
+                   policy=policy, refresh_links=args.refresh_links, concurrency=args.concurrency)
@@ -0,0 +1,372 @@
+"""
+Motor de descarga asyncio para 'Quién es Quién en los Precios' (Profeco).
+
+Alternativa a `download.download_files`: descubrimiento de ligas, sondeo HEAD, descarga
+por flujo o por segmentos, hash y metadatos corren como corrutinas bajo un semáforo global.
+Las escrituras a disco, el hash y la validación del RAR se delegan a un executor.
+Requiere `aiohttp` (pip install prices[async]).
+"""
+
+from src.config import BASE, RAW
+from src.utils.loggin_config import get_logger
+from src.utils.retry import RetryPolicy, StallError, TransferStats
+from src.download import (
+    URL_BASE,
+    parse_file_links,
+    load_links_cache,
+    save_links_cache,
+    is_links_cache_fresh,
+    load_download_metadata,
+    conditional_headers,
+    validators_match,
+    generate_download_metadata,
+    validate_download,
+    has_rar_signature,
+    InvalidArchiveError,
+    _filename_from_response,
+    _response_validators,
+    _content_range_start,
+    _partial_paths,
+    _load_partial,
+    _write_sidecar,
+    _drop_partial,
+    _split_ranges,
+    _load_segments_done,
+)
+
+import os
+import time
+import asyncio
+from hashlib import md5
+from datetime import datetime
+
+import aiohttp
+
+
+# loggin config
+logger = get_logger(__name__)
+
+MAX_CONCURRENCY = 32
+ASYNC_CHUNK_SIZE = 1024*1024  # 1 MB, se mantiene chico para muchas transferencias
+
+
+def _write_and_hash(f, chunk, hash_object):
+    f.write(chunk)
+    hash_object.update(chunk)
+
+def _hash_file(file_path):
+    hash_object = md5()
+    with open(file_path, 'rb') as f:
+        while block := f.read(ASYNC_CHUNK_SIZE * 8):
+            hash_object.update(block)
+    return hash_object
+
+async def get_file_links_async(session, refresh=False):
+    cache = await asyncio.to_thread(load_links_cache)
+    if not refresh and is_links_cache_fresh(cache):
+        return cache['links']
+
+    headers = conditional_headers(cache) if cache and not refresh else {}
+    async with session.get(URL_BASE, headers=headers) as response:
+        if response.status == 304:
+            logger.info('Profeco link index unchanged, reusing cache.\n')
+            await asyncio.to_thread(save_links_cache, cache['links'], cache.get('etag'), cache.get('last_modified'))
+            return cache['links']
+        if response.status != 200:
+            if cache and cache.get('links'):
+                logger.warning(f'Responce error {response.status}, using stale link cache.\n')
+                return cache['links']
+            logger.critical("Responce error. ")
+            return {}
+        content = await response.read()
+        etag, last_modified = response.headers.get('etag'), response.headers.get('last-modified')
+
+    links = parse_file_links(content)
+    await asyncio.to_thread(save_links_cache, links, etag, last_modified)
+    return links
+
+async def is_unchanged_async(session, url, metadata):
+    async with session.head(url, headers=conditional_headers(metadata), allow_redirects=True) as response:
+        if response.status == 304:
+            return True
+        if response.status != 200:
+            logger.warning(f'HEAD {url} returned {response.status}, assuming changed.\n')
+            return False
+        return validators_match(metadata, _response_validators(response))
+
+async def _needs_download(session, semaphore, year, url):
+    metadata = await asyncio.to_thread(load_download_metadata, url)
+    file_path = BASE / metadata['path'] if metadata else None
+
+    if not (file_path and file_path.is_file()):
+        return True
+    if metadata.get('content_length') not in (None, file_path.stat().st_size):
+        logger.warning(f'{file_path.name} is incomplete, downloading again...\n')
+        return True
+
+    async with semaphore:
+        unchanged = await is_unchanged_async(session, url, metadata)
+    if unchanged:
+        logger.info(f'Year {year} is up to date, skipping...\n')
+    else:
+        logger.info(f'Year {year} changed upstream, downloading again...\n')
+    return not unchanged
+
+async def _stream_to_part_async(session, semaphore, url, part_path, sidecar_path, policy, stats, resume=True):
+    loop = asyncio.get_running_loop()
+    offset, hash_object, validator = (
+        await asyncio.to_thread(_load_partial, url, part_path, sidecar_path, stats)
+        if resume else (0, md5(), None)
+    )
+
+    headers = {}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        if validator:
+            headers['If-Range'] = validator
+
+    async with semaphore, session.get(url, headers=headers) as response:
+        response.raise_for_status()
+        if offset and response.status == 206 and _content_range_start(response) == offset:
+            logger.info(f'Resuming {part_path.name} from byte {offset}\n')
+        elif offset:
+            logger.warning(f'Server ignored Range for {url}, downloading from scratch.\n')
+            stats.waste(offset)
+            offset, hash_object = 0, md5()
+
+        filename = _filename_from_response(response, url)
+        validators = _response_validators(response)
+        validator = validators['etag'] or validators['last_modified']
+
+        stall = policy.stall_detector()
+        with open(part_path, "r+b" if offset else "wb") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            try:
+                async for chunk in response.content.iter_chunked(ASYNC_CHUNK_SIZE):
+                    if offset == 0 and not has_rar_signature(chunk):
+                        raise InvalidArchiveError(f'{url} did not return a RAR archive')
+                    await loop.run_in_executor(None, _write_and_hash, f, chunk, hash_object)
+                    offset += len(chunk)
+                    if resume:
+                        await loop.run_in_executor(None, _write_sidecar, sidecar_path, {
+                            'url': url,
+                            'bytes_written': offset,
+                            'hash': hash_object.hexdigest(),
+                            'validator': validator,
+                        })
+                    # después de escribir: el chunk que dispara el error ya quedó en el parcial
+                    stall.update(len(chunk))
+            except (aiohttp.ClientError, asyncio.TimeoutError, StallError):
+                if not resume:
+                    stats.waste(offset)
+                raise
+
+    return filename, hash_object, validators
+
+async def _pwrite(fd, data, pos):
+    """`os.pwrite` en el executor. Si la tarea se cancela, espera a que el hilo termine: el fd sigue en uso."""
+    write = asyncio.get_running_loop().run_in_executor(None, os.pwrite, fd, data, pos)
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        await write
+        raise
+
+async def _fetch_segment_async(session, semaphore, url, fd, start, end, policy, stats, validator=None):
+    headers = {'Range': f'bytes={start}-{end}'}
+    if validator:
+        headers['If-Range'] = validator
+
+    async with semaphore, session.get(url, headers=headers) as response:
+        if response.status != 206 or _content_range_start(response) != start:
+            raise aiohttp.ClientPayloadError(
+                f'Expected 206 for bytes {start}-{end}, got {response.status}'
+            )
+        pos = start
+        stall = policy.stall_detector()
+        try:
+            async for chunk in response.content.iter_chunked(ASYNC_CHUNK_SIZE):
+                await _pwrite(fd, chunk, pos)
+                pos += len(chunk)
+                stall.update(len(chunk))
+        except (aiohttp.ClientError, asyncio.TimeoutError, StallError, asyncio.CancelledError):
+            # un segmento incompleto (también uno cancelado porque otro falló) se vuelve a pedir entero
+            stats.waste(pos - start)
+            raise
+
+    if pos != end + 1:
+        raise aiohttp.ClientPayloadError(f'Segment {start}-{end} ended at byte {pos}')
+    return start, end
+
+async def _segments_to_part_async(session, semaphore, url, part_path, sidecar_path, segments, policy, stats,
+                                  resume=True):
+    async with semaphore, session.head(url, allow_redirects=True) as head:
+        length = head.headers.get("content-length", "")
+        size = int(length) if length.isdigit() else 0
+        if head.status != 200 or size <= 0 or head.headers.get("accept-ranges") != "bytes":
+            logger.warning(f'{url} does not support byte ranges, using a single stream.\n')
+            return None
+        filename = _filename_from_response(head, url)
+        validators = _response_validators(head)
+    validator = validators['etag'] or validators['last_modified']
+
+    done = await asyncio.to_thread(
+        _load_segments_done, url, part_path, sidecar_path, size, validator, resume
+    )
+    pending = [r for r in _split_ranges(size, segments) if r not in done]
+    if done:
+        logger.info(f'Resuming {part_path.name}: {len(pending)} of {segments} segments left\n')
+
+    with open(part_path, "r+b" if done else "w+b") as f:
+        if not done:
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                f.truncate(size)
+
+        async def save_done():
+            if resume:
+                await asyncio.to_thread(_write_sidecar, sidecar_path, {
+                    'url': url,
+                    'size': size,
+                    'validator': validator,
+                    'segments_done': sorted(done),
+                })
+
+        tasks = [
+            asyncio.ensure_future(
+                _fetch_segment_async(session, semaphore, url, f.fileno(), start, end, policy, stats, validator)
+            )
+            for start, end in pending
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                done.add(await task)
+                await save_done()
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            # el fd se cierra al salir del `with`: antes deben terminar todas las tareas y sus escrituras;
+            # los segmentos que alcanzaron a terminar quedan para el siguiente intento
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            done.update(r for r in results if isinstance(r, tuple))
+            await save_done()
+            raise
+
+    hash_object = await asyncio.to_thread(_hash_file, part_path)
+    return filename, hash_object, validators
+
+async def download_file_async(session, semaphore, url, path=RAW, resume=True, segments=1, verify='auto',
+                              policy=None):
+    policy = policy or RetryPolicy()
+    stats = TransferStats()
+    part_path, sidecar_path = _partial_paths(url, path)
+    start = time.time()
+
+    while stats.attempts < policy.max_attempts:
+        stats.attempts += 1
+        if stats.attempts > 1:
+            await asyncio.sleep(policy.delay(stats.attempts - 1))
+
+        try:
+            result = None
+            if segments > 1:
+                result = await _segments_to_part_async(
+                    session, semaphore, url, part_path, sidecar_path, segments, policy, stats, resume
+                )
+                if result is None:
+                    _drop_partial(part_path, sidecar_path)
+            if result is None:
+                result = await _stream_to_part_async(
+                    session, semaphore, url, part_path, sidecar_path, policy, stats, resume
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError, StallError) as e:
+            logger.warning(f'Connection lost for {part_path.name} ({e}), '
+                           f'attempt {stats.attempts}/{policy.max_attempts}\n')
+            continue
+        except InvalidArchiveError as e:
+            logger.error(f'{e}, skipping.\n')
+            _drop_partial(part_path, sidecar_path)
+            return None
+
+        filename, hash_object, validators = result
+        file_path = path / filename
+        os.replace(part_path, file_path)
+        sidecar_path.unlink(missing_ok=True)
+
+        hash_value = hash_object.hexdigest()
+        valid, validation = await asyncio.to_thread(
+            validate_download, file_path, hash_value, validators['content_length'], verify
+        )
+        if valid:
+            break
+        logger.warning(f'Incomplete download for {file_path.name}, retrying...\n')
+        stats.waste(file_path.stat().st_size)
+        file_path.unlink(missing_ok=True)
+    else:
+        logger.error(f'Giving up on {url} after {stats.attempts} attempts '
+                     f'({stats.wasted_bytes} bytes wasted)\n')
+        return None
+
+    elapsed = time.time() - start
+    await asyncio.to_thread(
+        generate_download_metadata,
+        filename=filename,
+        file_path=file_path.relative_to(BASE),
+        url=url,
+        hash_value=hash_value,
+        is_valid_rar=valid,
+        download_time=elapsed,
+        validation=validation,
+        **validators,
+        **stats.as_dict()
+    )
+    logger.info(f"Data downloaded at: {file_path.relative_to(BASE)} in {elapsed:.1f}s\n")
+    return file_path
+
+async def run_downloader_async(years=None, path=RAW, segments=1, concurrency=MAX_CONCURRENCY,
+                               verify='auto', policy=None, refresh_links=False):
+    """
+    Versión asyncio de `download.run_downloader`. `concurrency` limita el total de
+    transferencias simultáneas (años más segmentos) en todo el proceso.
+    """
+    policy = policy or RetryPolicy()
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(sock_connect=policy.connect_timeout, sock_read=policy.read_timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async with semaphore:
+            links_dic = await get_file_links_async(session, refresh=refresh_links)
+
+        selected_years = [y for y in years if y in links_dic] if years else list(links_dic)
+        # un año que falla no cancela a los demás
+        checks = await asyncio.gather(
+            *(_needs_download(session, semaphore, y, links_dic[y]) for y in selected_years),
+            return_exceptions=True
+        )
+        for y, needed in zip(selected_years, checks):
+            if isinstance(needed, BaseException):
+                logger.warning(f'Cannot check year {y} ({needed!r}), downloading it again.\n')
+        links = [links_dic[y] for y, needed in zip(selected_years, checks) if needed]
+
+        if not links:
+            logger.info('All year files are already downloaded. ')
+            return []
+
+        start = datetime.now()
+        logger.info(f'Start download process at: {start.isoformat()})\n')
+        results = await asyncio.gather(
+            *(download_file_async(session, semaphore, url, path, segments=segments, verify=verify,
+                                  policy=policy)
+              for url in links),
+            return_exceptions=True
+        )
+        for i, (url, result) in enumerate(zip(links, results)):
+            if isinstance(result, BaseException):
+                logger.error(f'Download of {url} failed: {result!r}\n')
+                results[i] = None
+        end = datetime.now()
+        logger.info(f'End download process at: {end.isoformat()}')
+        return results
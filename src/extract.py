@@ -1,279 +1,1310 @@
-"""
-Modulo para extraer los archivos descargados de QQP. 
-"""
-
-from src.config import BASE, DATA, RAW
-from src.utils.loggin_config import get_logger
-
-import time
-import datetime
-import shutil
-import re
-import argparse
-from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
-from itertools import repeat
-
-import rarfile
-import pandas as pd
-
-# loggin config
-logger = get_logger(__name__)
-
-COLUMNS = {
-    'producto': str,
-    'presentacion': str,
-    'marca': str,
-    'categoria': 'category',
-    'catalogo': 'category',
-    'precio': float,
-    'fecha_registro': pd.to_datetime,
-    'cadena_comercial': str,
-    'giro': 'category',
-    'nombre_comercial': str,
-    'direccion': str,
-    'estado': 'category',
-    'municipio': 'category',
-    'latitud': float,
-    'longitud': float,
-}
-
-def get_year_from_string(string: str):
-    pattern = r"\b(20\d{2})\b"
-    m = re.search(pattern, str(string))
-    return m.group(1) if m else None
-
-def find_rar_files(years=[], base_path=RAW): 
-    rars = [base_path.joinpath(f"QQP_{y}.rar") for y in years]
-    existing = {y: p for y, p in zip(years, rars) if p.exists()}
-    missing = {y: p for y, p in zip(years, rars) if not p.exists()}
-
-    for k, v in missing.items(): 
-        logger.warning(f'{v.relative_to(BASE)} missing, needs to download.\n')
-    return existing, missing
-
-def find_unzipped_dirs(years=[], base_path=RAW):
-    dirs = [base_path.joinpath(f"QQP_{y}") for y in years]
-    existing = {y: p for y, p in zip(years, dirs) if p.exists() and p.is_dir()}
-    missing = {y: p for y, p in zip(years, dirs) if not p.exists() or not p.is_dir()}
-
-    for k, v in missing.items():
-        logger.warning(f'Directory {v.relative_to(base_path)} missing, need to extract.\n')
-    return existing, missing
-
-
-def extract_rar_file(rar_path: Path, dest_path: Path): 
-    try: 
-        with rarfile.RarFile(rar_path, mode='r') as archive: 
-            archive.extractall(path=str(dest_path))
-        logger.info(f'Extracted {rar_path.relative_to(BASE)} -> {dest_path.relative_to(BASE)}\n')
-        return True
-    
-    except rarfile.RarExecError as rex: 
-        logger.error(f'Rar exec error for {rar_path.relative_to(BASE)}: {rex}\n')
-    
-    except Exception as e: 
-        logger.error(f'Failed to extract {rar_path.relative_to(BASE)}: {e}\n')
-
-    return False
-
-def _is_empty_dir(path: Path): 
-    return not any(path.rglob("*"))
-
-def find_extracted_files(base_path: Path): 
-    if not base_path.exists():
-        return []
-    files = [p for p in base_path.rglob("*") 
-             if (p.is_file() and p.suffix.lower() in {'.csv', '.txt'})]
-    
-    return files
-
-def _csv_chunk_filter_and_append(input_file_path: Path, output_file: Path, chunksize=100_00):
-        for chunk in pd.read_csv(
-            input_file_path,
-            header=None,
-            names=COLUMNS.keys(),
-            chunksize=chunksize,
-            low_memory=True,encoding='latin1', 
-            sep=','
-            ):
-            mask = chunk['estado'].fillna('').str.upper() == 'SONORA'
-            filtered = chunk.loc[mask]
-            if not filtered.empty: 
-                filtered.to_csv(output_file, mode='a', header=True)
-
-
-def filter_sonora_and_save(input_csv_path: Path, output_dir: Path, year=None):
-    output_file_path = output_dir.joinpath(f"QQP_{year}_SON.csv")
-    output_file_path.touch(exist_ok=True)
-
-    sufix = input_csv_path.suffix
-
-    try: 
-        if sufix in {'.csv', '.txt'}: 
-            _ = _csv_chunk_filter_and_append(input_csv_path, output_file_path)
-        else: 
-            logger.warning(f'Unsopported file type: {sufix}; skipping: {input_csv_path.relative_to(BASE)}\n')
-            return None
-        
-    except Exception:
-        logger.exception("Error processing %s", input_csv_path)
-        return None
-
-
-def process_extraction(year, rar_path: Path, max_workers=24): 
-    extracted_dir = RAW / f"QQP_{year}"
-    extracted_dir.mkdir(parents=True, exist_ok=True)
-    
-    if _is_empty_dir(extracted_dir): 
-        success = extract_rar_file(rar_path, extracted_dir)
-        if not success: 
-            logger.error(f'Extraction failed for {rar_path.relative_to(BASE)}, skipping year {year}\n')
-            return False
-        
-    files = find_extracted_files(extracted_dir)
-    
-    output_dir = RAW / f"QQP_{year}_son/"
-    output_dir.mkdir(exist_ok=True)
-
-    with ThreadPoolExecutor() as executor: 
-        executor.map(filter_sonora_and_save, files, repeat(output_dir), repeat(year))
-    logger.info(f' Year: {year}; processed {len(files)} -> {output_dir.relative_to(BASE)}\n')
-    return True
-
-def cleanup_year(year, rar_path, base_path=RAW):
-    try:
-        if rar_path.exists():
-            rar_path.unlink()
-            logger.info(f'{rar_path.relative_to(BASE)} removed\n')
-
-        extracted_dir = base_path / f"QQP_{year}"
-        if extracted_dir.exists():
-            shutil.rmtree(extracted_dir)
-            logger.info(f'{extracted_dir.relative_to(base_path)} removed.\n')
-
-    except Exception as e:
-        logger.exception(f'Cleanup failed for year {year}: {e}\n')
-
-def merge_csv_years(years, base_path=RAW):
-    merged_dfs = []
-    years_str = "-".join(map(str, years))
-    output_file = base_path / f"qqp_{years_str}_sonora.csv"
-    output_file.touch()
-
-    for year in years:
-        year_dir = base_path / f"QQP_{year}_son"
-        if not year_dir.exists():
-            logger.warning(f" Directory {year_dir} not found, skipping. ")
-            continue
-
-        for csv_file in year_dir.glob("*.csv"):
-            try:
-                df = pd.read_csv(csv_file, dtype=str)
-                merged_dfs.append(df)
-                logger.info(f" Added {csv_file.relative_to(base_path)} with {len(df)} rows.")
-            except Exception as e:
-                logger.error(f" Failed reading {csv_file}: {e}")
-
-    if not merged_dfs:
-        logger.warning(" No CSV files to merge. ")
-        return None
-
-    merged_df = pd.concat(merged_dfs, ignore_index=True)
-    merged_df.to_csv(output_file, index=False)
-    logger.info(f" Merged {len(merged_df)} rows -> {output_file.relative_to(base_path)}")
-
-    return output_file
-
-
-def shoot_parallel_extraction(years, rar_paths, max_workers=4):
-    try: 
-        with ThreadPoolExecutor(max_workers=max_workers) as executor: 
-            executor.map(process_extraction, years, rar_paths)
-        return True
-    except Exception as e: 
-        logger.critical('Cannot process parallel extraction: {e}')
-
-def shoot_parallel_cleaning(years, rar_paths): 
-    try: 
-        with ThreadPoolExecutor(max_workers=4) as executor: 
-            executor.map(cleanup_year, years, rar_paths)
-        return True
-    except Exception as e: 
-        logger.critical('Cannot process parallel extraction: {e}')
-
-def run_extraction(years=[], clean=False, merge_all=False):
-
-    if not years: 
-        logger.critical(' No years provided, aborting.\n')
-        return
-    
-    existing_rars, _ = find_rar_files(years, RAW)
-    if not existing_rars: 
-        logger.critical(' No rar files found, aborting.\n')
-        return
-    
-    start = datetime.datetime.now()
-    logger.info(f'Start extraction process at: {start.isoformat()})\n')
-
-
-    # for year, zipf in existing_rars.items():
-    #     sucess = process_extraction(year, zipf)
-    sucess = shoot_parallel_extraction(
-        existing_rars.keys(), existing_rars.values()
-    )
-
-    if clean and sucess:
-        shoot_parallel_cleaning(
-        existing_rars.keys(), existing_rars.values()
-        )        
-        
-    if merge_all:
-        merge_csv_years(years)
-
-    end = datetime.datetime.now()
-    logger.info(f'End extraction process at: {end.isoformat()}')
-
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="Extrae y opcionalmente limpia y fusiona archivos RAR por año.")
-    
-    parser.add_argument(
-        '-y', '--years',
-        nargs='+',
-        type=int,
-        help='Lista de años a procesar (ej.: -y 2015 2016 2017)'
-    )
-    
-    parser.add_argument(
-        '-c', '--clean',
-        action='store_true',
-        help='Limpia los archivos extraídos después de procesarlos'
-    )
-    
-    parser.add_argument(
-        '-ma', '--merge-all',
-        action='store_true',
-        help='Fusiona todos los archivos CSV después de la extracción'
-    )
-
-    parser.add_argument(
-        '-m', '--merge',
-        nargs='+',
-        type=int,
-        help='Fusiona solo los CSV de los años especificados (ej.: -m 2015 2016)'
-    )
-    
-    args = parser.parse_args()
-    
-    if args.merge:
-        merge_csv_years(args.merge)
-    elif args.years:
-        run_extraction(years=args.years, clean=args.clean, merge_all=args.merge_all)
-    else:
-        logger.error("No se han especificado años para procesar.")
-        logger.info("Para ejecutar el programa, provee al menos un año con la opción '-y', por ejemplo:")
-        logger.info("    python script.py -y 2015 2016")
-        logger.info("Opciones disponibles:")
-        parser.print_help()
-
+"""
+Modulo para extraer los archivos descargados de QQP. 
+"""
+
+from src.config import BASE, DATA, RAW, PROCESSED
+from src.utils.loggin_config import get_logger
+from src.download import download_manifest
+from src.utils.manifest import open_manifest
+from src.utils.scheduler import Governor, DEFAULT_IO_WORKERS, DEFAULT_CPU_WORKERS
+from src.utils.states import state_code, state_slug, state_tokens, resolve_states
+from src.utils.prefilter import open_prefiltered
+from src.utils.filters import FilterSpec
+from src.utils.writer import acquire_writer, release_writer, WRITE_BUFFER
+from src.utils.memory import MemoryBudget, parse_size
+from src.utils.byterange import split_ranges, open_range
+from src.utils.catalog import atomic_path, read_catalog, update_partition, partition_files
+from src.utils.dictionaries import dictionary, concat_categorical
+from src.utils.dedup import KEY_COLUMNS, FINGERPRINT_COLUMN, FingerprintSet, IngestDedup, fingerprint, has_key
+
+import os
+import time
+import json
+import datetime
+import shutil
+import re
+import argparse
+from hashlib import md5
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from contextlib import nullcontext, ExitStack
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import rarfile
+import numpy as np
+import pandas as pd
+
+# loggin config
+logger = get_logger(__name__)
+
+CSV_SUFFIXES = {'.csv', '.txt'}
+BACKENDS = ('thread', 'process', 'serial')
+FORMATS = ('csv', 'parquet')
+DEFAULT_STATES = frozenset({'SON'})
+PARQUET_FLUSH_ROWS = 500_000
+MERGE_CHUNK_ROWS = 200_000
+
+COLUMNS = {
+    'producto': str,
+    'presentacion': str,
+    'marca': 'category',
+    'categoria': 'category',
+    'catalogo': 'category',
+    'precio': 'float32',
+    'fecha_registro': 'datetime64[ns]',
+    'cadena_comercial': 'category',
+    'giro': 'category',
+    'nombre_comercial': str,
+    'direccion': str,
+    'estado': 'category',
+    'municipio': 'category',
+    'latitud': 'float32',
+    'longitud': 'float32',
+}
+FLOAT_COLUMNS = [c for c, t in COLUMNS.items() if t == 'float32']
+DATE_COLUMNS = [c for c, t in COLUMNS.items() if t == 'datetime64[ns]']
+CATEGORY_COLUMNS = [c for c, t in COLUMNS.items() if t == 'category']
+# lo que read_csv puede tipar sin fallar; flotantes y fechas se ajustan por chunk en `apply_schema`
+PARSE_DTYPES = {c: t for c, t in COLUMNS.items() if c not in FLOAT_COLUMNS + DATE_COLUMNS}
+
+def get_year_from_string(string: str):
+    pattern = r"\b(20\d{2})\b"
+    m = re.search(pattern, str(string))
+    return m.group(1) if m else None
+
+def find_rar_files(years=[], base_path=RAW): 
+    manifest = download_manifest()
+    existing = {}
+    missing = {}
+
+    for y in years: 
+        record = manifest.get('year', y)
+        if record and record.get('valid') and (BASE / record['path']).is_file():
+            existing[y] = BASE / record['path']
+            continue
+
+        rar_path = base_path.joinpath(f"QQP_{y}.rar")
+        if record and not record.get('valid'):
+            missing[y] = rar_path
+        elif rar_path.exists():
+            logger.warning(f'{rar_path.relative_to(BASE)} is not in the download manifest, using it as is.\n')
+            existing[y] = rar_path
+        else:
+            missing[y] = rar_path
+
+    for k, v in missing.items(): 
+        logger.warning(f'{v.relative_to(BASE)} missing, needs to download.\n')
+    return existing, missing
+
+def find_unzipped_dirs(years=[], base_path=RAW):
+    dirs = [base_path.joinpath(f"QQP_{y}") for y in years]
+    existing = {y: p for y, p in zip(years, dirs) if p.exists() and p.is_dir()}
+    missing = {y: p for y, p in zip(years, dirs) if not p.exists() or not p.is_dir()}
+
+    for k, v in missing.items():
+        logger.warning(f'Directory {v.relative_to(base_path)} missing, need to extract.\n')
+    return existing, missing
+
+
+def extract_rar_file(rar_path: Path, dest_path: Path, members=None): 
+    try: 
+        with rarfile.RarFile(rar_path, mode='r') as archive: 
+            archive.extractall(path=str(dest_path), members=members)
+        logger.info(f'Extracted {rar_path.relative_to(BASE)} -> {dest_path.relative_to(BASE)}\n')
+        return True
+    
+    except rarfile.RarExecError as rex: 
+        logger.error(f'Rar exec error for {rar_path.relative_to(BASE)}: {rex}\n')
+    
+    except Exception as e: 
+        logger.error(f'Failed to extract {rar_path.relative_to(BASE)}: {e}\n')
+
+    return False
+
+def _is_empty_dir(path: Path): 
+    return not any(path.rglob("*"))
+
+def find_extracted_files(base_path: Path): 
+    if not base_path.exists():
+        return []
+    files = [p for p in base_path.rglob("*") 
+             if (p.is_file() and p.suffix.lower() in CSV_SUFFIXES)]
+    
+    return files
+
+def rar_member_infos(rar_path: Path): 
+    """Nombre, tamaño y CRC de cada CSV del RAR, leídos del encabezado (sin descomprimir)."""
+    with rarfile.RarFile(rar_path, mode='r') as archive: 
+        return [{'member': info.filename, 'size': info.file_size, 'crc': info.CRC} 
+                for info in archive.infolist() 
+                if (not info.is_dir() and Path(info.filename).suffix.lower() in CSV_SUFFIXES)]
+
+def extraction_manifest(): 
+    """
+    Manifiesto de extracción en data/raw/manifest_extract.jsonl: un registro por miembro 
+    procesado (año, nombre, tamaño, CRC y configuración de filtrado) con sus filas por estado.
+    """
+    return open_manifest(RAW / "manifest_extract.jsonl", indexes=('key',))
+
+def extraction_config(fmt='csv', partition_cols=None, states=DEFAULT_STATES, spec=None, dedup=True): 
+    """Huella de todo lo que cambia la salida de un miembro; otra configuración = otra clave."""
+    config = {
+        'fmt': fmt, 
+        'partition_cols': list(partition_cols) if fmt == 'parquet' and partition_cols else None, 
+        'states': sorted(states) if states is not None else 'all', 
+        'spec': asdict(spec) if spec is not None else None, 
+        # la deduplicación al ingerir es solo dentro del miembro (antes también entre miembros)
+        'dedup': 'member' if dedup else False, 
+        'columns': list(COLUMNS), 
+    }
+    return md5(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+def _member_key(year, info, config): 
+    return f"{year}:{info['member']}:{info['size']}:{info['crc']}:{config}"
+
+def _record_extraction(member, result): 
+    if result: 
+        extraction_manifest().append({
+            **member, 
+            'outputs': result['states'], 
+            'rows': result['rows'], 
+            'duplicates': result.get('duplicates', 0), 
+            'elapsed': result['elapsed'], 
+            'date_processed': datetime.datetime.now().isoformat(), 
+        })
+
+def apply_schema(df: pd.DataFrame, extend=True):
+    """
+    Ajusta `df` a los tipos de COLUMNS. Los valores malformados (texto en precio, 
+    fechas inválidas) quedan como NaN/NaT en lugar de tirar todo el chunk. 
+    Solo con `extend` (extracción) crecen los diccionarios de categorías; leer no los modifica.
+    """
+    typed = {}
+    for col in FLOAT_COLUMNS: 
+        if col not in df: 
+            continue
+        values = df[col]
+        if not pd.api.types.is_numeric_dtype(values): 
+            numeric = pd.to_numeric(values, errors='coerce')
+            bad = int((numeric.isna() & values.notna()).sum())
+            if bad: 
+                logger.warning(f'{bad} malformed values in {col}, set to NaN\n')
+            values = numeric
+        typed[col] = values.astype('float32')
+
+    for col in DATE_COLUMNS: 
+        if col in df and not pd.api.types.is_datetime64_any_dtype(df[col]): 
+            dates = pd.to_datetime(df[col], format='ISO8601', errors='coerce')
+            bad = int((dates.isna() & df[col].notna()).sum())
+            if bad: 
+                logger.warning(f'{bad} malformed values in {col}, set to NaT\n')
+            typed[col] = dates
+
+    # categorías con el diccionario global (data/processed/dictionaries): el mismo valor tiene 
+    # el mismo código en cualquier chunk, shard o año, así concat y joins no caen a object
+    for col in CATEGORY_COLUMNS: 
+        if col in df: 
+            typed[col] = dictionary(col).encode(df[col], extend)
+
+    return df.assign(**typed)
+
+def read_typed_csv(path, extend=False, **kwargs):
+    """Lee una salida filtrada (o el merge) con los tipos de COLUMNS; `extend` como en `apply_schema`."""
+    df = pd.read_csv(
+        path, 
+        usecols=lambda c: c in COLUMNS, 
+        dtype=PARSE_DTYPES, 
+        low_memory=True, 
+        **kwargs
+    )
+    # salidas anteriores a la etapa de escritura traen índice y el encabezado repetido por chunk
+    first = df.columns[0]
+    df = df.loc[df[first].astype(str) != first]
+    return apply_schema(df, extend)
+
+def _state_routes(estado: pd.Series, states=DEFAULT_STATES):
+    """Categoría de `estado` -> clave, solo para los estados pedidos (`states` None = todos)."""
+    routes = {}
+    for name in estado.cat.categories: 
+        code = state_code(name)
+        if states is None or code in states: 
+            routes[name] = code
+    return routes
+
+def _filtered_chunks(source, states=DEFAULT_STATES, spec: FilterSpec = None, memory: MemoryBudget = None, keep=(), 
+                     prefilter=True, dedup: IngestDedup = None):
+        """
+        Un solo recorrido del CSV nacional: cada chunk se reparte por estado y se 
+        produce (clave, filas tipadas) para cada estado pedido presente en el chunk.
+        Con `spec`, solo se parsean las columnas necesarias y los predicados se evalúan 
+        antes de tipar o escribir; `keep` son columnas que la salida necesita aunque no se proyecten.
+        Con `prefilter`, solo las líneas cuyos bytes mencionan un estado pedido llegan al parser.
+        El tamaño de cada chunk sale de `memory` (ver `ChunkSizer`); None usa el presupuesto por defecto.
+        Con `dedup`, las repetidas se quitan antes de proyectar: la llave se lee aunque no se pida.
+        """
+        always = ('estado', *keep, *(KEY_COLUMNS if dedup is not None else ()))
+        usecols = spec.read_columns(COLUMNS, always=always) if spec else None
+        tokens = state_tokens(states) if prefilter else None
+        # `source` puede ser una ruta o un archivo binario abierto (p. ej. un miembro del RAR)
+        with open_prefiltered(source, tokens) if tokens else nullcontext(source) as source: 
+            yield from _route_chunks(source, states, spec, memory or MemoryBudget.default(), keep, usecols, dedup)
+
+def _route_chunks(source, states, spec, memory, keep, usecols, dedup): 
+        try: 
+            reader = pd.read_csv(
+                source,
+                header=None,
+                names=list(COLUMNS),
+                usecols=usecols,
+                dtype=PARSE_DTYPES,
+                iterator=True,
+                low_memory=True,encoding='latin1', 
+                sep=','
+                )
+        except pd.errors.EmptyDataError: 
+            # el prefiltro no dejó pasar ninguna línea
+            return
+        sizer = memory.sizer()
+        with reader: 
+            while True: 
+                try: 
+                    chunk = reader.get_chunk(sizer.rows)
+                except StopIteration: 
+                    return
+                sizer.observe(chunk)
+                yield from _split_chunk(chunk, states, spec, keep, dedup)
+
+def _split_chunk(chunk, states, spec, keep, dedup): 
+        # se normalizan las categorías del chunk (decenas), no las filas; los estados 
+        # no pedidos (o falsos positivos del prefiltro) quedan en NaN y groupby los descarta
+        estado = chunk['estado']
+        key = estado.map(_state_routes(estado, states))
+        if spec is not None and spec.has_predicates: 
+            selected = key.notna()
+            if selected.any(): 
+                selected.loc[selected] = spec.mask(chunk.loc[selected])
+            key = key.where(selected)
+        for code, rows in chunk.groupby(key, observed=True, sort=False): 
+            rows = apply_schema(rows)
+            if dedup is not None: 
+                rows = dedup.filter(code, rows)
+                if rows.empty: 
+                    continue
+            yield code, spec.project(rows, keep) if spec else rows
+
+def _csv_chunk_filter_and_append(source, output_dir: Path, year, states=DEFAULT_STATES, 
+                                 source_name=None, spec=None, prefilter=True, memory=None, dedup=None, keep=()):
+        # los chunks van a la cola del escritor de cada salida; un solo hilo por archivo 
+        # escribe el encabezado una vez y en lotes grandes, aunque varias tareas compartan salida
+        rows = {}
+        writers = {}
+        with ExitStack() as stack: 
+            for code, filtered in _filtered_chunks(source, states, spec, memory, keep, prefilter, dedup): 
+                writer = writers.get(code)
+                if writer is None: 
+                    writer = writers[code] = acquire_writer(_output_path(output_dir, year, code, source_name))
+                    stack.callback(release_writer, writer)
+                writer.put(filtered)
+                rows[code] = rows.get(code, 0) + len(filtered)
+        return rows
+
+def _partition_keep(partition_cols): 
+    # el mes de la partición sale de fecha_registro aunque la proyección no la incluya
+    return ('fecha_registro',) + tuple(c for c in partition_cols or () if c in COLUMNS)
+
+def _parquet_filter_and_write(source, output_dir: Path, basename, year=None, states=DEFAULT_STATES, 
+                              partition_cols=None, spec=None, prefilter=True, memory=None, dedup=None):
+        chunks = _filtered_chunks(source, states, spec, memory, _partition_keep(partition_cols), prefilter, dedup)
+        return _write_parquet_chunks(chunks, output_dir, basename, year, partition_cols)
+
+def _write_parquet_chunks(chunks, output_dir: Path, basename, year=None, partition_cols=None): 
+        from src.utils.parquet import PARTITION_COLS, add_partition_columns, write_partitioned
+
+        # lo filtrado se junta por estado y se escribe en pocos archivos grandes en lugar 
+        # de uno por chunk; con muchos estados se vacía cada PARQUET_FLUSH_ROWS filas
+        pending, parts, rows = {}, {}, {}
+
+        def flush(code): 
+            df = add_partition_columns(concat_categorical(pending.pop(code), CATEGORY_COLUMNS), year)
+            part = parts[code] = parts.get(code, -1) + 1
+            rows[code] = rows.get(code, 0) + write_partitioned(
+                df, parquet_root(code, output_dir), f'{basename}-p{part}', partition_cols or PARTITION_COLS
+            )
+
+        for code, filtered in chunks: 
+            pending.setdefault(code, []).append(filtered)
+            if sum(map(len, pending[code])) >= PARQUET_FLUSH_ROWS: 
+                flush(code)
+        for code in list(pending): 
+            flush(code)
+        return rows
+
+
+def _source_stem(source_name):
+    return re.sub(r"[^\w.-]+", "_", Path(source_name).with_suffix("").as_posix())
+
+def parquet_root(state='SON', output_dir=PROCESSED):
+    """Un dataset por estado: `qqp_sonora`, `qqp_nuevo_leon`, ..."""
+    return output_dir / f"qqp_{state_slug(state_code(state))}"
+
+def _output_path(output_dir: Path, year, state='SON', source_name=None):
+    """
+    Carpeta `QQP_{year}_{estado}/`. Sin `source_name` todos los archivos del año 
+    comparten `QQP_{year}_{ESTADO}.csv`; con él, cada entrada escribe su propio shard privado.
+    """
+    state_dir = output_dir / f"QQP_{year}_{state.lower()}"
+    state_dir.mkdir(exist_ok=True)
+    if source_name is None: 
+        return state_dir.joinpath(f"QQP_{year}_{state}.csv")
+    return state_dir.joinpath(f"QQP_{year}_{state}_{_source_stem(source_name)}.csv")
+
+def _clear_member_outputs(output_dir: Path, year, source_name, states, fmt): 
+    """Borra lo que una corrida anterior escribió para este miembro, así volver a procesarlo no duplica filas."""
+    stem = _source_stem(source_name)
+    if fmt == 'parquet': 
+        roots = [parquet_root(code, output_dir) for code in states] if states is not None else output_dir.glob('qqp_*')
+        for root in roots: 
+            # `-r*` son los archivos de un CSV partido en rangos (ver `filter_csv_range_and_save`)
+            for pattern in (f'**/{year}-{stem}-p*-*.parquet', f'**/{year}-{stem}-r*-p*-*.parquet'): 
+                for old in root.glob(pattern): 
+                    old.unlink()
+        return
+
+    for code in _output_codes(output_dir, year, states): 
+        (output_dir / f"QQP_{year}_{code.lower()}" / f"QQP_{year}_{code}_{stem}.csv").unlink(missing_ok=True)
+
+def _clear_year_outputs(output_dir: Path, year, states, fmt): 
+    """Borra toda la salida del año para `states` (CSV compartido, shards o archivos Parquet)."""
+    if fmt == 'parquet': 
+        roots = [parquet_root(code, output_dir) for code in states] if states is not None else output_dir.glob('qqp_*')
+        for root in roots: 
+            for old in root.glob(f'**/{year}-*.parquet'): 
+                old.unlink()
+        return
+
+    for code in _output_codes(output_dir, year, states): 
+        for old in (output_dir / f"QQP_{year}_{code.lower()}").glob(f"QQP_{year}_{code}*.csv"): 
+            old.unlink()
+
+def _outputs_exist(output_dir: Path, year, record, fmt): 
+    """Si lo que el manifiesto registra como salida de un miembro (shards o archivos Parquet) sigue en disco."""
+    stem = _source_stem(record['member'])
+    for code, rows in record.get('outputs', {}).items(): 
+        if not rows: 
+            continue
+        if fmt == 'parquet': 
+            root = parquet_root(code, output_dir)
+            patterns = (f'**/{year}-{stem}-p*-*.parquet', f'**/{year}-{stem}-r*-p*-*.parquet')
+            if not any(next(root.glob(pattern), None) for pattern in patterns): 
+                return False
+        elif not (output_dir / f"QQP_{year}_{code.lower()}" / f"QQP_{year}_{code}_{stem}.csv").is_file(): 
+            return False
+    return True
+
+def _output_codes(output_dir: Path, year, states): 
+    if states is not None: 
+        return sorted(states)
+    return [d.name.split('_', 2)[2].upper() for d in output_dir.glob(f"QQP_{year}_*") if d.is_dir()]
+
+@dataclass(frozen=True)
+class FilterOptions: 
+    """
+    Todo lo que una tarea de filtrado necesita además de su entrada. Viaja entero a cada 
+    tarea (se puede picklear para el backend de procesos) en lugar de una tupla posicional.
+    """
+    output_dir: Path
+    year: object = None
+    shard: bool = False
+    fmt: str = 'csv'
+    partition_cols: tuple = None
+    states: frozenset = DEFAULT_STATES
+    spec: FilterSpec = None
+    prefilter: bool = True
+    memory: MemoryBudget = None
+    dedup: bool = True
+
+def _write_filtered(source, options: FilterOptions, output_dir: Path, basename, source_name, ingest): 
+    """Filtra `source` con `options` y escribe a `output_dir` (Parquet con `basename`, CSV con `source_name`)."""
+    if options.fmt == 'parquet': 
+        return _parquet_filter_and_write(
+            source, output_dir, basename, year=options.year, states=options.states, 
+            partition_cols=options.partition_cols, spec=options.spec, prefilter=options.prefilter, 
+            memory=options.memory, dedup=ingest
+        )
+    return _csv_chunk_filter_and_append(
+        source, output_dir, options.year, states=options.states, source_name=source_name, 
+        spec=options.spec, prefilter=options.prefilter, memory=options.memory, dedup=ingest
+    )
+
+def _filter_to_output(source, source_name, options: FilterOptions): 
+    """
+    Filtra `source` hacia CSV (carpetas por año y estado bajo `output_dir`) o hacia 
+    un dataset Parquet por estado bajo `output_dir`. Regresa ({clave de estado: filas}, repetidas).
+    """
+    if options.shard or options.fmt == 'parquet': 
+        _clear_member_outputs(options.output_dir, options.year, source_name, options.states, options.fmt)
+
+    # solo las repetidas dentro del miembro; entre miembros y años se quitan al fusionar
+    ingest = IngestDedup() if options.dedup else None
+    try: 
+        rows = _write_filtered(
+            source, options, options.output_dir, f'{options.year}-{_source_stem(source_name)}', 
+            source_name if options.shard else None, ingest
+        )
+        return rows, ingest.dropped if ingest is not None else 0
+    finally: 
+        if ingest is not None: 
+            ingest.close()
+
+def filter_states_and_save(input_csv_path: Path, options: FilterOptions):
+    sufix = input_csv_path.suffix
+    start = time.perf_counter()
+
+    try: 
+        if sufix in CSV_SUFFIXES: 
+            rows, duplicates = _filter_to_output(input_csv_path, input_csv_path.name, options)
+        else: 
+            logger.warning(f'Unsopported file type: {sufix}; skipping: {input_csv_path.relative_to(BASE)}\n')
+            return None
+        
+    except Exception:
+        logger.exception("Error processing %s", input_csv_path)
+        return None
+
+    return {'source': str(input_csv_path), 'output': str(options.output_dir), 'states': rows, 
+            'rows': sum(rows.values()), 'duplicates': duplicates, 'elapsed': time.perf_counter() - start}
+
+
+def filter_rar_member_and_save(rar_path: Path, member: str, options: FilterOptions):
+    """
+    Filtra un miembro del RAR leyéndolo como flujo (rarfile usa `unrar p` por debajo), 
+    sin escribir el CSV extraído a disco.
+    """
+    start = time.perf_counter()
+
+    try: 
+        with rarfile.RarFile(rar_path, mode='r') as archive, archive.open(member) as stream: 
+            rows, duplicates = _filter_to_output(stream, member, options)
+        
+    except Exception:
+        logger.exception("Error processing %s in %s", member, rar_path)
+        return None
+
+    return {'source': f'{rar_path.name}:{member}', 'output': str(options.output_dir), 'states': rows, 
+            'rows': sum(rows.values()), 'duplicates': duplicates, 'elapsed': time.perf_counter() - start}
+
+
+def _range_dir(output_dir: Path, year, source_name): 
+    return output_dir / f".ranges_{year}_{_source_stem(source_name)}"
+
+def _range_output(range_dir: Path, year, code, stem, part): 
+    return range_dir / f"QQP_{year}_{code.lower()}" / f"QQP_{year}_{code}_{stem}-r{part:03d}.csv"
+
+def filter_csv_range_and_save(input_csv_path: Path, start, end, part, options: FilterOptions):
+    """
+    Filtra solo los bytes [start, end) de un CSV extraído (ver `split_ranges`). En CSV cada 
+    rango escribe su propio archivo bajo `_range_dir` y `_join_ranges` los une en orden; 
+    en Parquet escribe directo al dataset con `-r{part}` en el nombre, que ya ordena.
+    Con dedup, en ambos formatos el rango deja sus filas en CSV con la huella de cada una 
+    y `_join_ranges_dedup` quita las que ya salieron en un rango anterior.
+    """
+    t0 = time.perf_counter()
+    stem = f'{_source_stem(input_csv_path.name)}-r{part:03d}'
+    ingest = IngestDedup(column=FINGERPRINT_COLUMN) if options.dedup else None
+
+    try: 
+        with open_range(input_csv_path, start, end) as source: 
+            if options.fmt == 'parquet' and ingest is None: 
+                rows = _write_filtered(source, options, options.output_dir, f'{options.year}-{stem}', None, ingest)
+            else: 
+                range_dir = _range_dir(options.output_dir, options.year, input_csv_path.name)
+                range_dir.mkdir(parents=True, exist_ok=True)
+                keep = _partition_keep(options.partition_cols) if options.fmt == 'parquet' else ()
+                rows = _csv_chunk_filter_and_append(
+                    source, range_dir, options.year, states=options.states, source_name=f'{stem}.csv', 
+                    spec=options.spec, prefilter=options.prefilter, memory=options.memory, dedup=ingest, 
+                    keep=keep + (FINGERPRINT_COLUMN,) if ingest is not None else keep
+                )
+    except Exception:
+        logger.exception("Error processing bytes %s-%s of %s", start, end, input_csv_path)
+        return None
+    finally: 
+        if ingest is not None: 
+            ingest.close()
+
+    return {'source': f'{input_csv_path}:{start}-{end}', 'output': str(options.output_dir), 'states': rows, 
+            'rows': sum(rows.values()), 'duplicates': ingest.dropped if ingest is not None else 0, 
+            'elapsed': time.perf_counter() - t0}
+
+def _join_ranges(input_csv_path: Path, output_dir: Path, year, parts, codes): 
+    """Une los CSV de cada rango, en orden y con un solo encabezado, en el shard del miembro."""
+    range_dir = _range_dir(output_dir, year, input_csv_path.name)
+    stem = _source_stem(input_csv_path.name)
+    for code in codes: 
+        header = True
+        with open(_output_path(output_dir, year, code, input_csv_path.name), 'wb') as out: 
+            for part in range(parts): 
+                path = _range_output(range_dir, year, code, stem, part)
+                if not path.is_file(): 
+                    continue
+                with open(path, 'rb') as f: 
+                    if not header: 
+                        f.readline()
+                    shutil.copyfileobj(f, out, WRITE_BUFFER)
+                header = False
+    shutil.rmtree(range_dir, ignore_errors=True)
+
+def _staged_chunks(range_dir: Path, year, code, stem, parts): 
+    """(huellas, chunk tipado) de los CSV de cada rango de `code`, en orden, para escribir Parquet."""
+    for part in range(parts): 
+        path = _range_output(range_dir, year, code, stem, part)
+        if not path.is_file(): 
+            continue
+        dtype = {**PARSE_DTYPES, FINGERPRINT_COLUMN: 'uint64'}
+        with pd.read_csv(path, dtype=dtype, chunksize=MERGE_CHUNK_ROWS) as reader: 
+            for chunk in reader: 
+                hashes = chunk.pop(FINGERPRINT_COLUMN).to_numpy(np.uint64)
+                yield hashes, apply_schema(chunk, extend=False)
+
+def _split_fingerprint(line: bytes): 
+    # la huella es la última columna y un entero sin comillas: basta con cortar en la última coma
+    body, _, tail = line.rpartition(b',')
+    value = tail.rstrip(b'\r\n')
+    return body + tail[len(value):], value
+
+def _join_staged_lines(range_dir: Path, year, code, stem, parts, output_path: Path, fps: FingerprintSet): 
+    """Une en CSV línea por línea, sin volver a parsear: pasan las filas con huella nueva, sin la huella."""
+    rows, header = 0, True
+    with open(output_path, 'wb') as out: 
+        for part in range(parts): 
+            path = _range_output(range_dir, year, code, stem, part)
+            if not path.is_file(): 
+                continue
+            with open(path, 'rb') as f: 
+                first = f.readline()
+                if header: 
+                    out.write(_split_fingerprint(first)[0])
+                    header = False
+                while lines := f.readlines(WRITE_BUFFER): 
+                    bodies, values = zip(*map(_split_fingerprint, lines))
+                    mask = fps.add(np.array([int(v) for v in values], dtype=np.uint64))
+                    out.writelines(body for body, new in zip(bodies, mask) if new)
+                    rows += int(mask.sum())
+    return rows
+
+def _join_ranges_dedup(input_csv_path: Path, options: FilterOptions, parts, codes): 
+    """
+    Como `_join_ranges` pero con la dedup del miembro completo: cada rango ya quitó sus propias 
+    repetidas, aquí se quitan las que repiten una fila de un rango anterior, así el resultado es 
+    el mismo que sin partir. Regresa ({clave de estado: filas}, repetidas entre rangos).
+    """
+    range_dir = _range_dir(options.output_dir, options.year, input_csv_path.name)
+    stem = _source_stem(input_csv_path.name)
+    rows, dropped = {}, 0
+    try: 
+        for code in codes: 
+            with FingerprintSet() as fps: 
+                if options.fmt == 'parquet': 
+                    chunks = ((code, chunk[fps.add(hashes)]) 
+                              for hashes, chunk in _staged_chunks(range_dir, options.year, code, stem, parts))
+                    rows.update(_write_parquet_chunks(
+                        chunks, options.output_dir, f'{options.year}-{stem}', options.year, options.partition_cols
+                    ))
+                else: 
+                    output_path = _output_path(options.output_dir, options.year, code, input_csv_path.name)
+                    rows[code] = _join_staged_lines(range_dir, options.year, code, stem, parts, output_path, fps)
+                dropped += fps.dropped
+    finally: 
+        shutil.rmtree(range_dir, ignore_errors=True)
+    return rows, dropped
+
+class _RangeJob: 
+    """
+    Un CSV extraído partido en rangos de bytes, cada uno una tarea de CPU. Se usa como 
+    un future: `result()` espera todos los rangos, los une en orden y regresa un solo resultado.
+    La salida siempre es el shard propio del miembro, así el orden no se mezcla con otros archivos.
+    """
+
+    def __init__(self, submit, path: Path, options: FilterOptions, ranges): 
+        self.path, self.options = path, options
+        self.output_dir, self.year, self.fmt = options.output_dir, options.year, options.fmt
+        self.parts = len(ranges)
+        _clear_member_outputs(self.output_dir, self.year, path.name, options.states, self.fmt)
+        shutil.rmtree(_range_dir(self.output_dir, self.year, path.name), ignore_errors=True)
+        self.futures = [
+            submit(filter_csv_range_and_save, path, start, end, part, options)
+            for part, (start, end) in enumerate(ranges)
+        ]
+
+    def result(self): 
+        results = [f.result() for f in self.futures]
+        if any(r is None for r in results): 
+            logger.error(f'{sum(r is None for r in results)} of {self.parts} ranges failed for {self.path}\n')
+            shutil.rmtree(_range_dir(self.output_dir, self.year, self.path.name), ignore_errors=True)
+            return None
+
+        rows = {}
+        for r in results: 
+            for code, n in r['states'].items(): 
+                rows[code] = rows.get(code, 0) + n
+        duplicates = sum(r['duplicates'] for r in results)
+        if self.options.dedup: 
+            rows, dropped = _join_ranges_dedup(self.path, self.options, self.parts, sorted(rows))
+            duplicates += dropped
+        elif self.fmt == 'csv': 
+            _join_ranges(self.path, self.output_dir, self.year, self.parts, sorted(rows))
+        return {'source': str(self.path), 'output': str(self.output_dir), 'states': rows, 
+                'rows': sum(rows.values()), 'duplicates': duplicates, 
+                'elapsed': sum(r['elapsed'] for r in results)}
+
+def submit_filter(submit, func, args, workers=1): 
+    """
+    Manda una tarea de filtrado con `submit(fn, *args)` (un executor o el gobernador). 
+    Un CSV extraído de al menos dos MIN_RANGE_BYTES se parte en hasta `workers` rangos 
+    que se filtran en paralelo, así un archivo gigante usa todos los núcleos igual que muchos chicos.
+    """
+    if func is filter_states_and_save and workers > 1 and args[0].suffix in CSV_SUFFIXES: 
+        path, options = args
+        try: 
+            ranges = split_ranges(path, workers)
+        except OSError as e: 
+            logger.warning(f'Cannot split {path}: {e}\n')
+            ranges = []
+        if len(ranges) > 1: 
+            return _RangeJob(submit, path, options, ranges)
+    return submit(func, *args)
+
+def run_tasks(func, *iterables, backend='thread', max_workers=None):
+    """
+    Mapea `func` con el backend elegido y regresa la lista de resultados.
+    'process' esquiva el GIL: cada worker abre su archivo y escribe su propio shard, 
+    el proceso padre solo recibe conteos y tiempos.
+    """
+    if backend == 'serial': 
+        return list(map(func, *iterables))
+    if backend == 'process': 
+        max_workers = min(max_workers or os.cpu_count(), os.cpu_count())
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    else: 
+        max_workers = max_workers or os.cpu_count()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    with executor: 
+        futures = [submit_filter(executor.submit, func, args, max_workers) for args in zip(*iterables)]
+        return [f.result() for f in futures]
+
+def memory_budget(memory_limit=None, workers=1, backend='thread'): 
+    """
+    Presupuesto de memoria de la extracción: `memory_limit` bytes (None = fracción de la RAM) 
+    repartidos entre los workers de CPU. Con hilos el RSS es uno solo; con procesos, uno por worker.
+    """
+    workers = 1 if backend == 'serial' else max(1, workers or 1)
+    if memory_limit is None: 
+        return MemoryBudget.default(workers, backend != 'process')
+    return MemoryBudget(int(memory_limit), workers, backend != 'process')
+
+def _log_results(year, results, wall, backend, output_dir):
+    done = [r for r in results if r]
+    rows = sum(r['rows'] for r in done)
+    busy = sum(r['elapsed'] for r in done)
+    by_state = {}
+    for r in done: 
+        for code, n in r['states'].items(): 
+            by_state[code] = by_state.get(code, 0) + n
+    states = ', '.join(f'{code}={n}' for code, n in sorted(by_state.items())) or 'none'
+    duplicates = sum(r.get('duplicates', 0) for r in done)
+    logger.info(f' Year: {year}; {len(done)}/{len(results)} inputs, {rows} rows ({states}), '
+                f'{duplicates} duplicates dropped in {wall:.1f}s '
+                f'(backend={backend}, worker time {busy:.1f}s) -> {output_dir.relative_to(BASE)}\n')
+
+
+def prepare_year(year, rar_path: Path, stream=False, shard=False, fmt='csv', partition_cols=None, 
+                 states=DEFAULT_STATES, spec=None, prefilter=True, incremental=True, memory=None, 
+                 dedup=True): 
+    """
+    Parte de I/O de un año: extrae el RAR (o lista sus miembros en modo stream).
+    Regresa (func, [args, ...], output_dir, [miembro, ...]) con las tareas de filtrado, o None si falla; 
+    cada `args` es la entrada más un `FilterOptions` compartido.
+    Cada archivo nacional se lee una vez sin importar cuántos estados se pidan.
+    Con `incremental`, los miembros ya procesados con la misma configuración (según el 
+    manifiesto de extracción) y cuya salida sigue en disco se saltan, y cada miembro escribe su propio shard.
+    """
+    output_dir = PROCESSED if fmt == 'parquet' else RAW
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    try: 
+        infos = rar_member_infos(rar_path)
+    except Exception as e: 
+        logger.error(f'Cannot read {rar_path.relative_to(BASE)}: {e}, skipping year {year}\n')
+        return None
+
+    config = extraction_config(fmt, partition_cols, states, spec, dedup)
+    members = [{**info, 'key': _member_key(year, info, config), 'year': str(year), 
+                'archive': rar_path.name, 'config': config} for info in infos]
+    if incremental: 
+        shard = True
+        # el CSV compartido del año viene de corridas no incrementales; sus filas se 
+        # duplicarían con los shards, y los miembros que cubre nunca se registraron
+        for code in _output_codes(output_dir, year, states) if fmt == 'csv' else []: 
+            shared = output_dir / f"QQP_{year}_{code.lower()}" / f"QQP_{year}_{code}.csv"
+            if shared.is_file(): 
+                logger.warning(f'Removing non-incremental output {shared.relative_to(BASE)}\n')
+                shared.unlink()
+        manifest = extraction_manifest()
+        pending = []
+        for m in members: 
+            record = manifest.get('key', m['key'])
+            if record is not None and not _outputs_exist(output_dir, year, record, fmt): 
+                logger.warning(f"Outputs of {m['member']} ({year}) are missing, processing it again\n")
+                record = None
+            if record is None: 
+                pending.append(m)
+        if len(pending) < len(members): 
+            logger.info(f'Year {year}: {len(members) - len(pending)} of {len(members)} members unchanged, skipping\n')
+    else: 
+        # se reprocesa todo: lo que quedó de corridas anteriores se duplicaría (el CSV compartido se anexa)
+        _clear_year_outputs(output_dir, year, states, fmt)
+        pending = members
+    # solo se registran los miembros con shard propio: el CSV compartido no se puede reemplazar por partes
+    recorded = pending if shard else []
+    options = FilterOptions(
+        output_dir=output_dir, year=year, shard=shard, fmt=fmt, 
+        partition_cols=tuple(partition_cols) if partition_cols else None, states=states, spec=spec, 
+        prefilter=prefilter, memory=memory, dedup=dedup
+    )
+
+    if stream: 
+        # download -> filtro directo: solo el RAR y la salida filtrada tocan el disco
+        return (filter_rar_member_and_save, [(rar_path, m['member'], options) for m in pending], 
+                output_dir, recorded)
+
+    extracted_dir = RAW / f"QQP_{year}"
+    extracted_dir.mkdir(parents=True, exist_ok=True)
+
+    # todo miembro pendiente se vuelve a extraer: un RAR actualizado puede traer un CSV 
+    # distinto con el mismo tamaño, y el archivo viejo se filtraría bajo el CRC nuevo
+    if pending: 
+        stale = [m['member'] for m in pending]
+        success = extract_rar_file(rar_path, extracted_dir, None if _is_empty_dir(extracted_dir) else stale)
+        if not success: 
+            logger.error(f'Extraction failed for {rar_path.relative_to(BASE)}, skipping year {year}\n')
+            return None
+
+    return (filter_states_and_save, [(extracted_dir / m['member'], options) for m in pending], 
+            output_dir, recorded)
+
+def process_extraction(year, rar_path: Path, max_workers=24, stream=False, backend='thread', 
+                       fmt='csv', partition_cols=None, states=DEFAULT_STATES, spec=None, prefilter=True, 
+                       incremental=True, memory_limit=None, dedup=True): 
+    start = time.perf_counter()
+    memory = memory_budget(memory_limit, max_workers, backend)
+    prepared = prepare_year(
+        year, rar_path, stream=stream, shard=backend == 'process', fmt=fmt, partition_cols=partition_cols, 
+        states=states, spec=spec, prefilter=prefilter, incremental=incremental, memory=memory, dedup=dedup
+    )
+    if prepared is None: 
+        return False
+
+    func, tasks, output_dir, members = prepared
+    results = run_tasks(func, *zip(*tasks), backend=backend, max_workers=max_workers) if tasks else []
+    for member, result in zip(members, results): 
+        _record_extraction(member, result)
+    _log_results(year, results, time.perf_counter() - start, backend, output_dir)
+    return True
+
+def cleanup_year(year, rar_path, base_path=RAW):
+    try:
+        if rar_path.exists():
+            rar_path.unlink()
+            logger.info(f'{rar_path.relative_to(BASE)} removed\n')
+
+        extracted_dir = base_path / f"QQP_{year}"
+        if extracted_dir.exists():
+            shutil.rmtree(extracted_dir)
+            logger.info(f'{extracted_dir.relative_to(base_path)} removed.\n')
+
+    except Exception as e:
+        logger.exception(f'Cleanup failed for year {year}: {e}\n')
+
+def states_on_disk(years, base_path=RAW): 
+    """Claves de estado con salida CSV de alguno de `years` (`QQP_{year}_{estado}/`)."""
+    codes = set()
+    for year in years: 
+        for state_dir in base_path.glob(f"QQP_{year}_*"): 
+            if state_dir.is_dir(): 
+                codes.add(state_dir.name.split('_', 2)[2].upper())
+    return sorted(codes)
+
+def _stream_shard(csv_file, chunksize=MERGE_CHUNK_ROWS): 
+    """
+    Chunks de texto de un shard tal cual (sin re-tipar), solo con columnas de COLUMNS: 
+    se cae el `Unnamed: 0` de salidas viejas escritas con índice y sus encabezados repetidos.
+    """
+    reader = pd.read_csv(
+        csv_file, 
+        usecols=lambda c: c in COLUMNS, 
+        dtype=str, 
+        keep_default_na=False, 
+        chunksize=chunksize, 
+    )
+    with reader: 
+        for chunk in reader: 
+            first = chunk.columns[0]
+            yield chunk.loc[chunk[first] != first]
+
+def _merge_shards(csv_files, output_file: Path, base_path=RAW, strict=False, dedup: FingerprintSet = None): 
+    """
+    Escribe `csv_files` en `output_file` chunk por chunk con un solo encabezado: la memoria 
+    depende del tamaño de chunk y la cola del escritor, no de cuántos archivos se junten.
+    Regresa (filas, columnas); columnas None si no hubo nada que unir. Con `strict`, un 
+    archivo ilegible aborta en lugar de saltarse. Con `dedup`, solo pasa la primera 
+    aparición de cada observación (las repetidas se cuentan en `dedup.dropped`).
+    """
+    columns = None
+    rows = 0
+    writer = acquire_writer(output_file)
+    try: 
+        for csv_file in csv_files:
+            try:
+                file_rows = 0
+                for chunk in _stream_shard(csv_file): 
+                    if dedup is not None and has_key(chunk): 
+                        chunk = chunk[dedup.add(fingerprint(chunk))]
+                    elif dedup is not None and not file_rows: 
+                        logger.warning(f' {csv_file.relative_to(base_path)} lacks the key columns '
+                                       f'(projected with --columns?), merging it without dedup.')
+                    # el primer shard fija el orden de columnas; los demás se alinean a él
+                    columns = columns or [c for c in COLUMNS if c in chunk]
+                    writer.put(chunk.reindex(columns=columns, fill_value=''))
+                    file_rows += len(chunk)
+                rows += file_rows
+                logger.info(f" Added {csv_file.relative_to(base_path)} with {file_rows} rows.")
+            except Exception as e:
+                if strict: 
+                    raise
+                logger.error(f" Failed reading {csv_file}: {e}")
+    finally: 
+        release_writer(writer)
+    return rows, columns
+
+def _year_shards(year, code, base_path=RAW): 
+    year_dir = base_path / f"QQP_{year}_{code.lower()}"
+    if not year_dir.exists():
+        logger.warning(f" Directory {year_dir} not found, skipping. ")
+        return []
+    return sorted(year_dir.glob("*.csv"))
+
+def merge_csv_years(years, base_path=RAW, state='SON', dedup=True):
+    """
+    Exporta los shards de `years` a un solo `qqp_{años}_{estado}.csv`, reconstruido completo. 
+    Para ir agregando años sin reescribir los demás usar `update_merged_dataset`.
+    """
+    code = state_code(state)
+    years_str = "-".join(map(str, years))
+    output_file = base_path / f"qqp_{years_str}_{state_slug(code)}.csv"
+    output_file.unlink(missing_ok=True)
+
+    csv_files = [f for year in years for f in _year_shards(year, code, base_path)]
+    # un solo conjunto de huellas para todos los años: también caen las repetidas entre años
+    with FingerprintSet() if dedup else nullcontext() as fps: 
+        rows, columns = _merge_shards(csv_files, output_file, base_path, dedup=fps)
+        duplicates = fps.dropped if fps is not None else 0
+
+    if columns is None:
+        logger.warning(" No CSV files to merge. ")
+        output_file.unlink(missing_ok=True)
+        return None
+
+    logger.info(f" Merged {rows} rows ({duplicates} duplicates dropped) -> {output_file.relative_to(base_path)}")
+    return output_file
+
+def merged_root(state='SON', output_dir=PROCESSED): 
+    """Dataset CSV fusionado del estado: un `year={año}.csv` por año más su `catalog.json`."""
+    return output_dir / f"qqp_{state_slug(state_code(state))}_csv"
+
+def _fingerprint_dir(root: Path, year): 
+    return root / ".fingerprints" / f"year={year}"
+
+def update_merged_dataset(years, base_path=RAW, state='SON', output_dir=PROCESSED, force=False, dedup=True): 
+    """
+    Agrega o refresca en el dataset fusionado solo las particiones de `years`; los demás 
+    años no se tocan. Un año cuyos shards (nombre, tamaño, mtime) no cambiaron según el 
+    catálogo se salta. Uno que cambió se escribe a un temporal que reemplaza su partición 
+    de una vez y luego se actualiza su entrada del catálogo; si falla, queda la partición anterior.
+    Con `dedup`, cada observación queda una sola vez en todo el dataset: cada partición guarda 
+    las huellas de lo que conservó (`.fingerprints/year={año}/`) y las de los años anteriores 
+    cuentan como vistas, así una repetida entre años queda en el más antiguo. Por eso reescribir 
+    un año también reescribe los años posteriores deduplicados, que pudieron descartar filas 
+    por lo que ese año tenía antes.
+    """
+    code = state_code(state)
+    root = merged_root(code, output_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    partitions = read_catalog(root)['partitions']
+    requested = {str(year) for year in years}
+
+    seen = []           # huellas de las particiones anteriores
+    rebuilt = False     # alguna partición anterior se reescribió en esta corrida
+    for year in sorted(requested | set(partitions), key=int): 
+        current = partitions.get(year)
+        path = root / f"year={year}.csv"
+        fingerprints = _fingerprint_dir(root, year)
+        cascade = rebuilt and bool(current and current.get('dedup', False))
+        if year not in requested and not cascade: 
+            seen.append(fingerprints)
+            continue
+
+        csv_files = _year_shards(year, code, base_path)
+        if not csv_files: 
+            if cascade: 
+                logger.warning(f" No shards left to rebuild {path.relative_to(output_dir)}, keeping it as is. ")
+            seen.append(fingerprints)
+            continue
+        year_dedup = dedup if year in requested else True
+        sources = [[f.name, f.stat().st_size, f.stat().st_mtime_ns] for f in csv_files]
+        if (not force and not cascade and current and current['sources'] == sources 
+                and current.get('dedup', False) == year_dedup and path.is_file() 
+                and (not year_dedup or fingerprints.is_dir())): 
+            logger.info(f" {path.relative_to(output_dir)} is up to date, skipping. ")
+            seen.append(fingerprints)
+            continue
+
+        try: 
+            with atomic_path(path) as tmp, FingerprintSet(seen=seen) if year_dedup else nullcontext() as fps: 
+                rows, columns = _merge_shards(csv_files, tmp, base_path, strict=True, dedup=fps)
+                duplicates = fps.dropped if fps is not None else 0
+                if fps is not None: 
+                    fps.save(fingerprints)
+                else: 
+                    shutil.rmtree(fingerprints, ignore_errors=True)
+        except Exception as e: 
+            logger.error(f" Failed updating {path.relative_to(output_dir)}, keeping the previous partition: {e}")
+            seen.append(fingerprints)
+            continue
+        update_partition(root, year, {'path': path.name, 'rows': rows, 'columns': columns, 'sources': sources, 
+                                      'dedup': year_dedup, 'duplicates': duplicates})
+        logger.info(f" Merged {rows} rows ({duplicates} duplicates dropped) -> {path.relative_to(output_dir)}")
+        seen.append(fingerprints)
+        rebuilt = True
+
+    return root
+
+def read_merged(state='SON', years=None, output_dir=PROCESSED, **kwargs): 
+    """Lee (tipado) el dataset fusionado del estado, todo o solo `years`, según su catálogo."""
+    files = partition_files(merged_root(state, output_dir), years)
+    if not files: 
+        return pd.DataFrame(columns=list(COLUMNS))
+    return concat_categorical((read_typed_csv(f, **kwargs) for f in files), CATEGORY_COLUMNS, extend=False)
+
+def merge_parquet_years(years, base_path=RAW, state='SON', output_dir=PROCESSED, partition_cols=None):
+    """
+    Convierte los shards CSV ya filtrados de `years` al dataset Parquet particionado 
+    del estado, en lugar de concatenarlos en un solo CSV.
+    """
+    from src.utils.parquet import PARTITION_COLS, add_partition_columns, write_partitioned
+
+    code = state_code(state)
+    root = parquet_root(code, output_dir)
+    rows = 0
+    for year in years:
+        year_dir = base_path / f"QQP_{year}_{code.lower()}"
+        if not year_dir.exists():
+            logger.warning(f" Directory {year_dir} not found, skipping. ")
+            continue
+
+        for csv_file in year_dir.glob("*.csv"):
+            try:
+                df = add_partition_columns(read_typed_csv(csv_file, extend=True), year)
+                rows += write_partitioned(df, root, f'{year}-{csv_file.stem}', partition_cols or PARTITION_COLS)
+                logger.info(f" Added {csv_file.relative_to(base_path)} with {len(df)} rows.")
+            except Exception as e:
+                logger.error(f" Failed converting {csv_file}: {e}")
+
+    logger.info(f" Wrote {rows} rows -> {root}")
+    return root
+
+
+def shoot_parallel_extraction(years, rar_paths, governor: Governor, stream=False, fmt='csv', partition_cols=None, 
+                              states=DEFAULT_STATES, spec=None, prefilter=True, incremental=True, memory=None, 
+                              dedup=True):
+    """
+    Manda el trabajo de todos los años a un solo gobernador: la extracción va al 
+    presupuesto de I/O y, en cuanto un año termina, sus archivos al de CPU.
+    """
+    try: 
+        shard = governor.backend == 'process'
+        starts = {}
+        io_futures = {}
+        for year, rar_path in zip(years, rar_paths): 
+            starts[year] = time.perf_counter()
+            io_futures[governor.submit_io(
+                prepare_year, year, rar_path, stream=stream, shard=shard, fmt=fmt, partition_cols=partition_cols, 
+                states=states, spec=spec, prefilter=prefilter, incremental=incremental, memory=memory, dedup=dedup
+            )] = year
+
+        cpu_futures = {}
+        for future in as_completed(io_futures): 
+            year = io_futures[future]
+            prepared = future.result()
+            if prepared is None: 
+                continue
+            func, tasks, output_dir, members = prepared
+            cpu_futures[year] = (output_dir, members, [
+                submit_filter(governor.submit_cpu, func, args, governor.cpu_workers) for args in tasks
+            ])
+
+        for year, (output_dir, members, futures) in cpu_futures.items(): 
+            results = [f.result() for f in futures]
+            for member, result in zip(members, results): 
+                _record_extraction(member, result)
+            _log_results(year, results, time.perf_counter() - starts[year], governor.backend, output_dir)
+        return True
+    except Exception as e: 
+        logger.critical(f'Cannot process parallel extraction: {e}')
+
+def shoot_parallel_cleaning(years, rar_paths, governor: Governor): 
+    try: 
+        futures = [governor.submit_io(cleanup_year, y, p) for y, p in zip(years, rar_paths)]
+        for future in futures: 
+            future.result()
+        return True
+    except Exception as e: 
+        logger.critical(f'Cannot process parallel cleaning: {e}')
+
+def run_extraction(years=[], clean=False, merge_all=False, stream=False, backend='thread', 
+                   io_workers=DEFAULT_IO_WORKERS, cpu_workers=DEFAULT_CPU_WORKERS, 
+                   fmt='csv', partition_cols=None, states=DEFAULT_STATES, spec=None, prefilter=True, 
+                   incremental=True, memory_limit=None, dedup=True):
+
+    if not years: 
+        logger.critical(' No years provided, aborting.\n')
+        return
+    
+    if spec is not None: 
+        spec.validate(COLUMNS)
+        logger.info(f'Using {spec}\n')
+
+    existing_rars, _ = find_rar_files(years, RAW)
+    if not existing_rars: 
+        logger.critical(' No rar files found, aborting.\n')
+        return
+    
+    start = datetime.datetime.now()
+    logger.info(f'Start extraction process at: {start.isoformat()})\n')
+
+
+    # for year, zipf in existing_rars.items():
+    #     sucess = process_extraction(year, zipf)
+    with Governor(io_workers, cpu_workers, backend) as governor: 
+        memory = memory_budget(memory_limit, governor.cpu_workers, backend)
+        logger.info(f'Using {governor}, {memory}\n')
+        sucess = shoot_parallel_extraction(
+            existing_rars.keys(), existing_rars.values(), governor, stream=stream, 
+            fmt=fmt, partition_cols=partition_cols, states=states, spec=spec, prefilter=prefilter, 
+            incremental=incremental, memory=memory, dedup=dedup
+        )
+
+        if clean and sucess:
+            shoot_parallel_cleaning(
+            existing_rars.keys(), existing_rars.values(), governor
+            )        
+        
+    if merge_all and fmt == 'parquet': 
+        logger.info(f'Parquet output is already one dataset per state under {PROCESSED.relative_to(BASE)}\n')
+    elif merge_all:
+        for code in sorted(states) if states is not None else states_on_disk(years, RAW): 
+            update_merged_dataset(years, RAW, code, dedup=dedup)
+
+    end = datetime.datetime.now()
+    logger.info(f'End extraction process at: {end.isoformat()}')
+
+
+def parse_where(items): 
+    """['catalogo=BASICOS,MEDICAMENTOS', ...] -> {'catalogo': ['BASICOS', 'MEDICAMENTOS']}"""
+    equals = {}
+    for item in items or []: 
+        column, sep, values = item.partition('=')
+        if not sep or not values: 
+            raise argparse.ArgumentTypeError(f'Invalid --where {item!r}, expected columna=valor[,valor...]')
+        equals.setdefault(column.strip(), []).extend(v.strip() for v in values.split(','))
+    return equals
+
+def filter_spec_from_args(args): 
+    """Especificación del archivo (--filter-spec) con los flags de la CLI encima; None si no hay filtros."""
+    spec = FilterSpec.from_file(args.filter_spec) if args.filter_spec else FilterSpec()
+    where = parse_where(args.where)
+    spec = spec.update(
+        equals={**spec.equals, **where} if where else None, 
+        date_from=args.date_from, 
+        date_to=args.date_to, 
+        bbox=tuple(args.bbox) if args.bbox else None, 
+        columns=tuple(args.columns) if args.columns else None, 
+    )
+    return spec if spec != FilterSpec() else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Extrae y opcionalmente limpia y fusiona archivos RAR por año.")
+    
+    parser.add_argument(
+        '-y', '--years',
+        nargs='+',
+        type=int,
+        help='Lista de años a procesar (ej.: -y 2015 2016 2017)'
+    )
+    
+    parser.add_argument(
+        '-c', '--clean',
+        action='store_true',
+        help='Limpia los archivos extraídos después de procesarlos'
+    )
+    
+    parser.add_argument(
+        '-ma', '--merge-all',
+        action='store_true',
+        help='Agrega los años extraídos al dataset fusionado de cada estado después de la extracción'
+    )
+
+    parser.add_argument(
+        '-s', '--stream',
+        action='store_true',
+        help='Filtra leyendo directo del RAR, sin extraer los CSV a disco'
+    )
+
+    parser.add_argument(
+        '-b', '--backend',
+        choices=BACKENDS,
+        default='thread',
+        help='Cómo paralelizar el filtrado por archivo: hilos, procesos (sin GIL) o en serie'
+    )
+
+    parser.add_argument(
+        '--io-workers',
+        type=int,
+        default=DEFAULT_IO_WORKERS,
+        help='Presupuesto global para trabajo de disco (extracción de RAR, borrado)'
+    )
+
+    parser.add_argument(
+        '--cpu-workers',
+        type=int,
+        default=DEFAULT_CPU_WORKERS,
+        help='Presupuesto global para parseo y filtrado de CSV'
+    )
+
+    parser.add_argument(
+        '--states',
+        nargs='+',
+        default=['SONORA'],
+        help="Estados a filtrar en una sola pasada, por nombre o clave (ej.: --states SONORA SIN CHIH), o 'all'"
+    )
+
+    parser.add_argument(
+        '--filter-spec',
+        type=Path,
+        help='Archivo .toml o .json con equals/date_from/date_to/bbox/columns; los flags de abajo lo sobreescriben'
+    )
+
+    parser.add_argument(
+        '--where',
+        action='append',
+        metavar='COLUMNA=VALOR[,VALOR...]',
+        help="Igualdad/IN sobre una columna, repetible (ej.: --where catalogo=BASICOS --where cadena_comercial=SORIANA,WALMART)"
+    )
+
+    parser.add_argument('--date-from', help='Primer día de fecha_registro a conservar (YYYY-MM-DD)')
+    parser.add_argument('--date-to', help='Último día de fecha_registro a conservar (YYYY-MM-DD)')
+
+    parser.add_argument(
+        '--bbox',
+        nargs=4,
+        type=float,
+        metavar=('LAT_MIN', 'LON_MIN', 'LAT_MAX', 'LON_MAX'),
+        help='Solo filas con latitud/longitud dentro de la caja'
+    )
+
+    parser.add_argument(
+        '--columns',
+        nargs='+',
+        choices=list(COLUMNS),
+        metavar='COLUMNA',
+        help='Columnas a conservar en la salida; las demás ni se parsean'
+    )
+
+    parser.add_argument(
+        '--prefilter',
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help='Descarta por bytes las líneas que no mencionan un estado pedido antes de parsear '
+             '(desactivar si hay saltos de línea dentro de campos entrecomillados)'
+    )
+
+    parser.add_argument(
+        '--incremental',
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help='Salta los miembros del RAR ya procesados con la misma configuración (manifest_extract.jsonl); '
+             'con --no-incremental se reprocesa todo'
+    )
+
+    parser.add_argument(
+        '--dedup',
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help='Descarta observaciones repetidas (tienda, producto, presentación, fecha y precio) : al ingerir '
+             'dentro de cada archivo y al fusionar (-m, --merge-all) entre archivos y años'
+    )
+
+    parser.add_argument(
+        '--memory-limit',
+        type=parse_size,
+        metavar='TAMAÑO',
+        help='Memoria total para el filtrado (ej.: 4G, 512M); el tamaño de chunk se ajusta a esto '
+             'entre los --cpu-workers y al RSS observado. Por defecto, la mitad de la RAM'
+    )
+
+    parser.add_argument(
+        '-f', '--format',
+        choices=FORMATS,
+        default='csv',
+        help='Salida filtrada: shards CSV por año o un dataset Parquet particionado por año/mes'
+    )
+
+    parser.add_argument(
+        '--partition-municipio',
+        action='store_true',
+        help='Con --format parquet, particiona también por municipio'
+    )
+
+    parser.add_argument(
+        '-m', '--merge',
+        nargs='+',
+        type=int,
+        help='Agrega o refresca solo estos años en el dataset fusionado del estado '
+             '(data/processed/qqp_{estado}_csv, con catalog.json) (ej.: -m 2024 2025)'
+    )
+    
+    args = parser.parse_args()
+    partition_cols = ['year', 'month', 'municipio'] if args.partition_municipio else None
+    states = resolve_states(args.states)
+    spec = filter_spec_from_args(args)
+    
+    if args.merge:
+        for code in sorted(states) if states is not None else states_on_disk(args.merge): 
+            if args.format == 'parquet': 
+                merge_parquet_years(args.merge, state=code, partition_cols=partition_cols)
+            else: 
+                update_merged_dataset(args.merge, state=code, dedup=args.dedup)
+    elif args.years:
+        run_extraction(years=args.years, clean=args.clean, merge_all=args.merge_all, 
+                       stream=args.stream, backend=args.backend, 
+                       io_workers=args.io_workers, cpu_workers=args.cpu_workers, 
+                       fmt=args.format, partition_cols=partition_cols, states=states, spec=spec, 
+                       prefilter=args.prefilter, incremental=args.incremental, 
+                       memory_limit=args.memory_limit, dedup=args.dedup)
+    else:
+        logger.error("No se han especificado años para procesar.")
+        logger.info("Para ejecutar el programa, provee al menos un año con la opción '-y', por ejemplo:")
+        logger.info("    python script.py -y 2015 2016")
+        logger.info("Opciones disponibles:")
+        parser.print_help()
+
@@ -0,0 +1,63 @@
+"""Rangos de bytes alineados a saltos de línea para parsear un CSV grande en paralelo"""
+
+import io
+import os
+import mmap
+
+MIN_RANGE_BYTES = 64 * 1024 * 1024
+
+
+def split_ranges(path, parts, min_bytes=MIN_RANGE_BYTES):
+    """
+    Hasta `parts` rangos [inicio, fin) que cubren todo `path`, de al menos `min_bytes`
+    cada uno; todo corte cae justo después de un '\\n', así ninguna línea queda partida.
+    Supone que los campos no traen saltos de línea dentro de comillas.
+    """
+    size = os.path.getsize(path)
+    parts = max(1, min(parts, size // max(1, min_bytes)))
+    if parts == 1:
+        return [(0, size)]
+
+    cuts = [0]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i in range(1, parts):
+            pos = mm.find(b'\n', max(cuts[-1], size * i // parts))
+            if pos < 0 or pos + 1 >= size:
+                break
+            cuts.append(pos + 1)
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+class MmapRangeReader(io.RawIOBase):
+    """Lee los bytes [start, end) de `path` directo del mapa en memoria, sin copiar el rango."""
+
+    def __init__(self, path, start, end):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._mm, 'madvise'):
+            self._mm.madvise(mmap.MADV_SEQUENTIAL)
+        self._view = memoryview(self._mm)[start:end]
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), len(self._view) - self._pos)
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            # el mapa no se puede cerrar mientras exista la vista
+            self._view.release()
+            self._mm.close()
+            self._file.close()
+        super().close()
+
+
+def open_range(path, start, end):
+    """Archivo binario con solo los bytes [start, end) de `path`."""
+    return io.BufferedReader(MmapRangeReader(path, start, end), buffer_size=1024 * 1024)
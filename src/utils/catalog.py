@@ -0,0 +1,57 @@
+"""Catálogo de particiones de un dataset fusionado: qué archivo cubre cada año y de qué fuentes salió"""
+
+import os
+import json
+import threading
+import datetime
+from pathlib import Path
+from contextlib import contextmanager
+
+CATALOG_NAME = 'catalog.json'
+
+_lock = threading.Lock()
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Ruta temporal junto a `path`; al salir sin error reemplaza `path` de una sola vez
+    (os.replace), así un lector ve el archivo viejo o el nuevo completo, nunca uno a medias.
+    """
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def read_catalog(root):
+    """{'partitions': {clave: registro}}; vacío si el dataset aún no existe."""
+    path = Path(root) / CATALOG_NAME
+    if not path.is_file():
+        return {'partitions': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def update_partition(root, key, record):
+    """Registra (o reemplaza) la partición `key` y reescribe el catálogo atómicamente."""
+    root = Path(root)
+    with _lock:
+        catalog = read_catalog(root)
+        catalog['partitions'][str(key)] = {**record, 'updated': datetime.datetime.now().isoformat()}
+        catalog['partitions'] = dict(sorted(catalog['partitions'].items()))
+        with atomic_path(root / CATALOG_NAME) as tmp:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(catalog, f, ensure_ascii=False, indent=2)
+    return catalog
+
+
+def partition_files(root, keys=None):
+    """Archivos de las particiones del catálogo (todas, o solo `keys`), en orden de clave."""
+    root = Path(root)
+    partitions = read_catalog(root)['partitions']
+    wanted = None if keys is None else {str(k) for k in keys}
+    return [root / record['path'] for key, record in partitions.items() if wanted is None or key in wanted]
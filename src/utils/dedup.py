@@ -0,0 +1,186 @@
+"""Eliminación de observaciones repetidas por huella de 64 bits, con memoria acotada"""
+
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# tienda, producto, presentación, fecha y precio
+KEY_COLUMNS = ('cadena_comercial', 'nombre_comercial', 'direccion', 'producto', 'presentacion',
+               'fecha_registro', 'precio')
+DATE_COLUMN, PRICE_COLUMN = 'fecha_registro', 'precio'
+FINGERPRINT_COLUMN = '_fingerprint'     # huellas que viajan con las filas entre tareas (ver IngestDedup)
+FINGERPRINT_BUDGET = 32 * 1024 * 1024   # bytes de huellas en memoria antes de volcar a disco
+PARTITION_BITS = 4                      # 16 particiones por los bits altos de la huella
+MAX_RUNS = 8                            # corridas por partición antes de fusionarlas en una
+_SHIFT = np.uint64(64 - PARTITION_BITS)
+_PARTITIONS = 1 << PARTITION_BITS
+
+
+def has_key(df):
+    return all(c in df for c in KEY_COLUMNS)
+
+
+def fingerprint(df: pd.DataFrame, columns=KEY_COLUMNS):
+    """
+    Huella uint64 por fila. Acepta el chunk tipado o en texto: la fecha se compara como
+    instante y el precio en centavos, así '12.5' y 12.5 (float32) dan la misma huella.
+    """
+    key = {}
+    for col in columns:
+        values = df[col]
+        if col == DATE_COLUMN and not pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.to_datetime(values, format='ISO8601', errors='coerce')
+        elif col == PRICE_COLUMN:
+            values = (pd.to_numeric(values, errors='coerce').astype('float64') * 100).round()
+        key[col] = values
+    return pd.util.hash_pandas_object(pd.DataFrame(key, index=df.index), index=False).to_numpy(np.uint64)
+
+
+def _contains(sorted_values, values):
+    """Qué `values` (ordenados) están en `sorted_values`; sirve igual sobre un memmap."""
+    if not len(sorted_values) or not len(values):
+        return np.zeros(len(values), dtype=bool)
+    idx = np.searchsorted(sorted_values, values)
+    idx[idx == len(sorted_values)] = len(sorted_values) - 1
+    return np.asarray(sorted_values[idx]) == values
+
+
+def _partition_bounds(sorted_values):
+    # ordenadas, las huellas de cada partición (bits altos) quedan contiguas
+    edges = np.arange(1, _PARTITIONS, dtype=np.uint64) << _SHIFT
+    return np.concatenate(([0], np.searchsorted(sorted_values, edges), [len(sorted_values)]))
+
+
+class FingerprintSet:
+    """
+    Conjunto de huellas vistas. Las recientes viven en un arreglo ordenado en memoria; cuando
+    pasa de `budget` bytes se vuelca como corridas ordenadas, una por partición, a `spill_dir`
+    (temporal si no se da) y se consultan por memmap. `seen` son directorios guardados con
+    `save` (p. ej. de otras particiones) que cuentan como ya vistos pero no se modifican.
+    """
+
+    def __init__(self, budget=FINGERPRINT_BUDGET, spill_dir=None, seen=()):
+        self.budget = budget
+        self._spill_dir = Path(spill_dir) if spill_dir else None
+        self._own_spill = spill_dir is None
+        self._mem = np.empty(0, dtype=np.uint64)
+        self._runs = [[] for _ in range(_PARTITIONS)]
+        self._seen = [[] for _ in range(_PARTITIONS)]
+        self._spills = 0
+        self.kept = 0
+        self.dropped = 0
+        for directory in seen:
+            for p in range(_PARTITIONS):
+                path = Path(directory) / f'p{p:02d}.npy'
+                if path.is_file():
+                    self._seen[p].append(np.load(path, mmap_mode='r'))
+
+    def add(self, hashes):
+        """Máscara de las filas cuya huella aparece por primera vez; las demás cuentan como repetidas."""
+        uniq, first = np.unique(hashes, return_index=True)
+        new = ~_contains(self._mem, uniq)
+        parts = uniq >> _SHIFT
+        for p in np.unique(parts[new]):
+            runs = self._runs[p] + self._seen[p]
+            if not runs:
+                continue
+            sel = np.flatnonzero(new & (parts == p))
+            for run in runs:
+                hit = _contains(run, uniq[sel])
+                new[sel[hit]] = False
+                sel = sel[~hit]
+
+        added = uniq[new]
+        self._mem = np.insert(self._mem, np.searchsorted(self._mem, added), added)
+        self.kept += len(added)
+        self.dropped += len(hashes) - len(added)
+        if self._mem.nbytes > self.budget:
+            self._spill()
+
+        mask = np.zeros(len(hashes), dtype=bool)
+        mask[first[new]] = True
+        return mask
+
+    def _spill(self):
+        if self._spill_dir is None:
+            self._spill_dir = Path(tempfile.mkdtemp(prefix='qqp-dedup-'))
+        self._spill_dir.mkdir(parents=True, exist_ok=True)
+        bounds = _partition_bounds(self._mem)
+        for p in range(_PARTITIONS):
+            part = self._mem[bounds[p]:bounds[p + 1]]
+            if not len(part):
+                continue
+            if len(self._runs[p]) >= MAX_RUNS:
+                # muchas corridas encarecen cada consulta: se fusionan en una sola
+                old, self._runs[p] = self._runs[p], []
+                part = np.unique(np.concatenate([np.asarray(r) for r in old] + [part]))
+                paths = [r.filename for r in old]
+                del old
+                for path in paths:
+                    Path(path).unlink(missing_ok=True)
+            path = self._spill_dir / f'p{p:02d}-{self._spills:05d}.npy'
+            np.save(path, part)
+            self._runs[p].append(np.load(path, mmap_mode='r'))
+        self._spills += 1
+        self._mem = np.empty(0, dtype=np.uint64)
+
+    def save(self, directory):
+        """Guarda las huellas propias (no las de `seen`) en `directory`, un archivo ordenado por partición."""
+        directory = Path(directory)
+        shutil.rmtree(directory, ignore_errors=True)
+        directory.mkdir(parents=True)
+        bounds = _partition_bounds(self._mem)
+        for p in range(_PARTITIONS):
+            parts = [np.asarray(r) for r in self._runs[p]] + [self._mem[bounds[p]:bounds[p + 1]]]
+            values = np.unique(np.concatenate(parts))
+            if len(values):
+                np.save(directory / f'p{p:02d}.npy', values)
+
+    def close(self):
+        self._runs = [[] for _ in range(_PARTITIONS)]
+        self._seen = [[] for _ in range(_PARTITIONS)]
+        if self._own_spill and self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class IngestDedup:
+    """
+    Un FingerprintSet por estado para lo que escribe una tarea de ingesta: solo quita las
+    repetidas dentro de la propia tarea. Entre miembros y años se deduplica al fusionar, donde
+    el resultado no depende de qué miembros se volvieron a procesar.
+    Recibe las filas antes de proyectar: sin las columnas de la llave `fingerprint` falla.
+    Con `column`, las filas que pasan llevan su huella en esa columna, así otra etapa puede
+    seguir deduplicando sin la llave (p. ej. entre los rangos de un mismo miembro).
+    """
+
+    def __init__(self, budget=FINGERPRINT_BUDGET, column=None):
+        self.budget = budget
+        self.column = column
+        self.sets = {}
+
+    def filter(self, code, df):
+        fps = self.sets.get(code)
+        if fps is None:
+            fps = self.sets[code] = FingerprintSet(self.budget)
+        hashes = fingerprint(df)
+        mask = fps.add(hashes)
+        if self.column is None:
+            return df[mask]
+        return df[mask].assign(**{self.column: hashes[mask]})
+
+    @property
+    def dropped(self):
+        return sum(fps.dropped for fps in self.sets.values())
+
+    def close(self):
+        for fps in self.sets.values():
+            fps.close()
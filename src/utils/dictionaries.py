@@ -0,0 +1,156 @@
+"""Diccionarios globales y persistentes de las columnas categóricas: un valor tiene el mismo código en todo shard y año"""
+
+import json
+import threading
+from pathlib import Path
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from src.config import PROCESSED
+
+DICTIONARY_DIR = PROCESSED / "dictionaries"
+
+try:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+except ImportError:  # Windows
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class CategoryDictionary:
+    """
+    Valores de una columna en orden de llegada, en `{root}/{column}.jsonl` (un valor JSON
+    por línea). Solo se agrega al final, así el código de un valor (su posición) nunca cambia
+    y un dtype viejo siempre es prefijo del actual. Varios procesos lo extienden a la vez:
+    quien agrega toma el candado del archivo y antes relee lo que otros hayan escrito.
+    """
+
+    def __init__(self, column, root=DICTIONARY_DIR):
+        self.column = column
+        self.path = Path(root) / f'{column}.jsonl'
+        self.values = []
+        self.codes = {}
+        self._offset = 0
+        self._dtype = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if not self.path.is_file():
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break   # a medio escribir por otro proceso
+                self._offset += len(line)
+                value = json.loads(line)
+                if value not in self.codes:
+                    self.codes[value] = len(self.values)
+                    self.values.append(value)
+                    self._dtype = None
+
+    def _dtype_now(self):
+        if self._dtype is None:
+            self._dtype = pd.CategoricalDtype(self.values)
+        return self._dtype
+
+    @property
+    def dtype(self):
+        with self._lock:
+            self._refresh()
+            return self._dtype_now()
+
+    def extend(self, values):
+        """Agrega los valores aún no vistos de `values`; regresa el dtype con todos los conocidos."""
+        with self._lock:
+            missing = [v for v in dict.fromkeys(map(str, values)) if v not in self.codes]
+            if missing:
+                self._refresh()
+                missing = [v for v in missing if v not in self.codes]
+            if missing:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path.with_suffix('.lock'), 'a+b') as lock:
+                    _lock_file(lock)
+                    try:
+                        self._refresh()
+                        missing = [v for v in missing if v not in self.codes]
+                        if missing:
+                            data = ''.join(json.dumps(v, ensure_ascii=False) + '\n' for v in missing)
+                            with open(self.path, 'ab') as f:
+                                f.write(data.encode('utf-8'))
+                            self._refresh()
+                    finally:
+                        _unlock_file(lock)
+            return self._dtype_now()
+
+    def encode(self, values: pd.Series, extend=True):
+        """
+        `values` como categórica con el dtype global; con `extend` el diccionario crece con lo
+        nuevo. Sin `extend` (lecturas) el diccionario no se toca: si `values` trae algo que no
+        conoce, queda con categorías propias en lugar de perder esos valores.
+        """
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            seen = values.cat.categories
+        else:
+            seen = values.dropna().unique()
+        if extend:
+            return values.astype(self.extend(seen))
+        dtype = self.dtype
+        if pd.Index(seen).astype(str).isin(dtype.categories).all():
+            return values.astype(dtype)
+        return values.astype('category')
+
+    def align(self, values: pd.Series, extend=True):
+        """
+        Una categórica codificada con una versión anterior de este diccionario pasa al
+        dtype actual reutilizando sus códigos tal cual; cualquier otra se recodifica (ver `encode`).
+        """
+        dtype = self.dtype
+        cats = values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else None
+        if cats is not None and len(cats) <= len(dtype.categories) and cats.equals(dtype.categories[:len(cats)]):
+            return pd.Series(pd.Categorical.from_codes(values.cat.codes, dtype=dtype), index=values.index,
+                             name=values.name)
+        return self.encode(values, extend)
+
+
+_dictionaries = {}
+_registry_lock = threading.Lock()
+
+
+def dictionary(column, root=None):
+    """El diccionario de `column` (uno por proceso, compartido entre hilos)."""
+    key = (column, Path(root or DICTIONARY_DIR))
+    with _registry_lock:
+        if key not in _dictionaries:
+            _dictionaries[key] = CategoryDictionary(column, key[1])
+        return _dictionaries[key]
+
+
+def concat_categorical(frames, columns, root=None, extend=True):
+    """
+    pd.concat que conserva las categóricas: cada frame se lleva al dtype global más
+    reciente (mismos códigos) para que concat no caiga a object. Sin `extend`, una columna
+    con valores fuera del diccionario se une con union_categoricals.
+    """
+    aligned = [f.assign(**{c: dictionary(c, root).align(f[c], extend) for c in columns if c in f}) for f in frames]
+    df = pd.concat(aligned, ignore_index=True)
+    for c in columns:
+        parts = [f[c] for f in aligned if c in f]
+        if c in df and len(parts) == len(aligned) and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = union_categoricals(parts, ignore_order=True)
+    return df
@@ -0,0 +1,127 @@
+"""Filtros declarativos (predicados + proyección) que se aplican por chunk al extraer"""
+
+import json
+import tomllib
+from pathlib import Path
+from dataclasses import dataclass, field, replace
+
+import pandas as pd
+
+DATE_COLUMN = 'fecha_registro'
+LAT_COLUMN, LON_COLUMN = 'latitud', 'longitud'
+
+
+def _normalize(value):
+    return str(value).strip().upper()
+
+
+def _isin(values: pd.Series, allowed):
+    """IN sin distinguir mayúsculas; en categorías se evalúa sobre las categorías, no las filas."""
+    allowed = {_normalize(v) for v in allowed}
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        cats = values.cat.categories
+        return values.isin(cats[cats.astype(str).str.strip().str.upper().isin(allowed)])
+    return values.astype(str).str.strip().str.upper().isin(allowed)
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """
+    - equals: {columna: [valores]} igualdad/IN, pensado para las categóricas (catalogo, cadena_comercial, ...).
+    - date_from / date_to: rango inclusivo sobre fecha_registro ('YYYY-MM-DD').
+    - bbox: (lat_min, lon_min, lat_max, lon_max).
+    - columns: proyección; None conserva todas.
+    """
+    equals: dict = field(default_factory=dict)
+    date_from: str = None
+    date_to: str = None
+    bbox: tuple = None
+    columns: tuple = None
+
+    @classmethod
+    def from_mapping(cls, data):
+        data = dict(data)
+        unknown = set(data) - {'equals', 'date_from', 'date_to', 'bbox', 'columns'}
+        if unknown:
+            raise ValueError(f'Unknown filter keys: {sorted(unknown)}')
+        equals = {col: [v] if isinstance(v, str) else list(v) for col, v in data.get('equals', {}).items()}
+        return cls(
+            equals=equals,
+            date_from=data.get('date_from'),
+            date_to=data.get('date_to'),
+            bbox=tuple(data['bbox']) if data.get('bbox') else None,
+            columns=tuple(data['columns']) if data.get('columns') else None,
+        )
+
+    @classmethod
+    def from_file(cls, path):
+        """Lee la especificación de un .toml o .json."""
+        path = Path(path)
+        if path.suffix == '.toml':
+            with open(path, 'rb') as f:
+                return cls.from_mapping(tomllib.load(f))
+        with open(path, encoding='utf-8') as f:
+            return cls.from_mapping(json.load(f))
+
+    def update(self, **changes):
+        """Copia con los campos dados que no sean None (la CLI sobreescribe al archivo)."""
+        return replace(self, **{k: v for k, v in changes.items() if v is not None})
+
+    def validate(self, known_columns):
+        named = set(self.equals) | set(self.columns or ())
+        unknown = named - set(known_columns)
+        if unknown:
+            raise ValueError(f'Unknown columns in filter: {sorted(unknown)}')
+        if self.bbox is not None and len(self.bbox) != 4:
+            raise ValueError('bbox needs 4 values: lat_min lon_min lat_max lon_max')
+        for value in (self.date_from, self.date_to):
+            if value is not None:
+                pd.Timestamp(value)
+        return self
+
+    @property
+    def has_predicates(self):
+        return bool(self.equals or self.date_from or self.date_to or self.bbox)
+
+    def predicate_columns(self):
+        cols = set(self.equals)
+        if self.date_from or self.date_to:
+            cols.add(DATE_COLUMN)
+        if self.bbox:
+            cols |= {LAT_COLUMN, LON_COLUMN}
+        return cols
+
+    def read_columns(self, all_columns, always=()):
+        """Columnas a parsear (orden de `all_columns`): proyección + predicados + `always`."""
+        if self.columns is None:
+            return None
+        wanted = set(self.columns) | self.predicate_columns() | set(always)
+        return [c for c in all_columns if c in wanted]
+
+    def mask(self, df: pd.DataFrame):
+        """Máscara booleana vectorizada; acepta el chunk crudo o ya tipado."""
+        keep = pd.Series(True, index=df.index)
+        for col, values in self.equals.items():
+            keep &= _isin(df[col], values)
+
+        if self.date_from or self.date_to:
+            dates = df[DATE_COLUMN]
+            if not pd.api.types.is_datetime64_any_dtype(dates):
+                dates = pd.to_datetime(dates, format='ISO8601', errors='coerce')
+            if self.date_from:
+                keep &= dates >= pd.Timestamp(self.date_from)
+            if self.date_to:
+                keep &= dates < pd.Timestamp(self.date_to) + pd.Timedelta(days=1)
+
+        if self.bbox:
+            lat_min, lon_min, lat_max, lon_max = self.bbox
+            lat = pd.to_numeric(df[LAT_COLUMN], errors='coerce')
+            lon = pd.to_numeric(df[LON_COLUMN], errors='coerce')
+            keep &= lat.between(lat_min, lat_max) & lon.between(lon_min, lon_max)
+        return keep
+
+    def project(self, df: pd.DataFrame, keep=()):
+        if self.columns is None:
+            return df
+        wanted = set(self.columns) | set(keep)
+        return df[[c for c in df.columns if c in wanted]]
@@ -0,0 +1,66 @@
+"""Sesión HTTP compartida para el tráfico hacia Profeco"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 3
+DEFAULT_TIMEOUT = (10, 60)  # (connect, read) en segundos
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_default_session = None
+_default_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter que aplica un timeout por defecto a cada request."""
+
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, retries=3, backoff_factor=1.0):
+    """
+    Crea una sesión con keep-alive, un pool de `pool_size` conexiones por host, 
+    timeouts por defecto y reintentos con backoff para GET/HEAD.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        backoff_factor=backoff_factor,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        pool_block=True,
+        max_retries=retry,
+        timeout=timeout,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Sesión por defecto del proceso, creada la primera vez que se pide."""
+    global _default_session
+    with _default_lock:
+        if _default_session is None:
+            _default_session = make_session()
+        return _default_session
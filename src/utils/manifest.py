@@ -0,0 +1,78 @@
+"""Manifiestos JSONL de solo-anexar con índices en memoria"""
+
+import json
+import threading
+from pathlib import Path
+
+from src.utils.loggin_config import get_logger
+
+logger = get_logger(__name__)
+
+_open_manifests = {}
+_open_lock = threading.Lock()
+
+
+class Manifest:
+    """
+    Un registro JSON por línea; nunca se reescriben líneas, solo se anexan.
+    Cada campo en `indexes` tiene un dict valor -> último registro, así que las
+    búsquedas son O(1) y el registro más reciente de una clave es el que cuenta.
+    Seguro para escrituras concurrentes desde hilos del mismo proceso.
+    """
+
+    def __init__(self, path, indexes=('key',)):
+        self.path = Path(path)
+        self._indexes = {field: {} for field in indexes}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    self._index(json.loads(line))
+                except ValueError:
+                    # una línea truncada por un corte a mitad de escritura
+                    logger.warning(f'Skipping corrupt line {n} in {self.path.name}\n')
+
+    def _index(self, record):
+        for field, index in self._indexes.items():
+            value = record.get(field)
+            if value is not None:
+                index[str(value)] = record
+
+    def get(self, field, value):
+        return self._indexes[field].get(str(value))
+
+    def latest(self, field):
+        """Último registro por cada valor de `field`."""
+        with self._lock:
+            return dict(self._indexes[field])
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+            self._index(record)
+        return record
+
+    def __len__(self):
+        first = next(iter(self._indexes.values()))
+        return len(first)
+
+
+def open_manifest(path, indexes=('key',)):
+    """Regresa la instancia compartida del manifiesto en `path`."""
+    path = Path(path).resolve()
+    with _open_lock:
+        manifest = _open_manifests.get(path)
+        if manifest is None:
+            manifest = _open_manifests[path] = Manifest(path, indexes)
+        return manifest
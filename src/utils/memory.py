@@ -0,0 +1,105 @@
+"""Presupuesto de memoria y tamaño de chunk adaptativo para el lector de CSV"""
+
+import os
+import re
+from dataclasses import dataclass
+
+MIN_CHUNK_ROWS = 10_000
+MAX_CHUNK_ROWS = 2_000_000
+INITIAL_BYTES_PER_ROW = 1_000   # 15 columnas, la mayoría texto, antes de medir
+SAFETY = 4                      # chunk + temporales del parser + copias filtradas y tipadas
+HIGH_WATER = 0.9                # fracción del límite de RSS a partir de la cual se encoge el chunk
+DEFAULT_MEMORY_FRACTION = 0.5
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(text):
+    """'512M', '4G', '1.5g', '1073741824' -> bytes"""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?)I?B?\s*', str(text).upper())
+    if not match:
+        raise ValueError(f'Invalid size {text!r}, expected e.g. 512M or 4G')
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def rss_bytes():
+    """RSS actual del proceso desde /proc/self/statm; None fuera de Linux."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@dataclass(frozen=True)
+class MemoryBudget:
+    """
+    `limit` bytes para toda la extracción, repartidos entre `workers`.
+    Con hilos (`shared`) todos comparten un RSS que se compara contra `limit`;
+    con procesos cada worker tiene el suyo y se compara contra su parte.
+    """
+    limit: int
+    workers: int = 1
+    shared: bool = True
+
+    @classmethod
+    def default(cls, workers=1, shared=True):
+        total = physical_memory() or 4 * 1024 ** 3
+        return cls(int(total * DEFAULT_MEMORY_FRACTION), workers, shared)
+
+    @property
+    def per_worker(self):
+        return self.limit // max(1, self.workers)
+
+    @property
+    def rss_limit(self):
+        return self.limit if self.shared else self.per_worker
+
+    def __str__(self):
+        mode = 'shared RSS' if self.shared else 'RSS per worker'
+        return f'MemoryBudget({self.limit / 2**20:.0f} MiB over {self.workers} workers, {mode})'
+
+    def sizer(self):
+        return ChunkSizer(self)
+
+
+class ChunkSizer:
+    """
+    Filas del próximo chunk: la parte de memoria de este worker entre los bytes por fila
+    medidos (muestra de cada chunk, promedio móvil). Si el RSS observado pasa de
+    HIGH_WATER del límite, el chunk se reduce a la mitad en cada lectura hasta bajar.
+    """
+
+    def __init__(self, budget: MemoryBudget, min_rows=MIN_CHUNK_ROWS, max_rows=MAX_CHUNK_ROWS):
+        self.budget = budget
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.bytes_per_row = INITIAL_BYTES_PER_ROW
+        self.rows = self._clamp(self._target())
+
+    def _clamp(self, rows):
+        return int(max(self.min_rows, min(self.max_rows, rows)))
+
+    def _target(self):
+        return self.budget.per_worker // (self.bytes_per_row * SAFETY)
+
+    def observe(self, chunk):
+        if len(chunk):
+            # memory_usage(deep) recorre cada string; con una muestra basta
+            sample = chunk.iloc[:1_000]
+            measured = sample.memory_usage(deep=True, index=False).sum() / len(sample)
+            self.bytes_per_row = max(1, (self.bytes_per_row + measured) / 2)
+
+        target = self._target()
+        rss = rss_bytes()
+        if rss is not None and rss > self.budget.rss_limit * HIGH_WATER:
+            target = min(target, self.rows // 2)
+        self.rows = self._clamp(target)
+        return self.rows
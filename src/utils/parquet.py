@@ -0,0 +1,66 @@
+"""Salida columnar: dataset Parquet particionado (estilo hive) por año y mes"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARTITION_COLS = ['year', 'month']
+ROW_GROUP_SIZE = 128 * 1024
+
+
+def _dataset_schema(df):
+    """
+    Esquema de Arrow para `df`. Las categorías usan siempre índices int32 para que
+    todos los archivos del dataset compartan esquema (pandas elige int8/int16 según el chunk).
+    """
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_dictionary(field.type):
+            schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), field.type.value_type)))
+    return schema
+
+
+def add_partition_columns(df, year=None, date_column='fecha_registro'):
+    """`year` del archivo fuente si se conoce; si no, el de la fecha. `month` siempre de la fecha."""
+    dates = df[date_column]
+    return df.assign(
+        year=year if year is not None else dates.dt.year.astype('Int16'),
+        month=dates.dt.month.astype('Int8'),
+    )
+
+
+def write_partitioned(df, root, basename, partition_cols=PARTITION_COLS):
+    """
+    Escribe `df` en `root/year=.../month=.../{basename}-{i}.parquet`. Con el mismo
+    `basename` una corrida nueva reemplaza sus archivos en lugar de duplicarlos.
+    """
+    if df.empty:
+        return 0
+    # las categorías vienen del diccionario global (todo lo visto en cualquier año): cada
+    # archivo guarda solo las que usa, si no el diccionario de cada columna va completo
+    df = df.assign(**{c: df[c].cat.remove_unused_categories()
+                      for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    table = pa.Table.from_pandas(df, schema=_dataset_schema(df), preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=str(root),
+        partition_cols=list(partition_cols),
+        basename_template=f'{basename}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+        use_dictionary=True,
+        write_statistics=True,
+        row_group_size=ROW_GROUP_SIZE,
+        compression='zstd',
+    )
+    return len(df)
+
+
+def read_dataset(root, columns=None, filters=None):
+    """
+    Lee solo las columnas y particiones pedidas, p. ej.
+    read_dataset(root, columns=['precio', 'municipio'], filters=[('year', '=', 2024), ('month', 'in', [1, 2])])
+    """
+    table = pq.read_table(str(root), columns=columns, filters=filters, partitioning='hive')
+    # las columnas de partición vuelven como diccionarios; los metadatos de pandas 
+    # (Int16/Int8 al escribir) no aplican a ese tipo
+    return table.to_pandas(ignore_metadata=True)
@@ -0,0 +1,105 @@
+"""Prefiltro a nivel de bytes: deja pasar al parser de CSV solo las líneas con un token"""
+
+import io
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def _fold_table():
+    # latin1 byte a byte -> mayúscula sin acento ('ó' -> 'O'); mismo largo, así las
+    # posiciones de los saltos de línea no cambian
+    table = bytearray(range(256))
+    for i in range(256):
+        folded = unicodedata.normalize('NFKD', chr(i)).encode('ascii', 'ignore').upper()
+        if len(folded) == 1:
+            table[i] = folded[0]
+    return bytes(table)
+
+_FOLD = _fold_table()
+
+
+class PrefilteredReader(io.RawIOBase):
+    """
+    Lee `raw` en bloques binarios grandes y entrega solo las líneas completas que
+    contienen alguno de `tokens` (comparados en mayúsculas y sin acentos).
+    Todo es vectorizado con numpy sobre el bloque: no se crea un objeto por línea.
+    Es un superconjunto: quien lo use debe volver a aplicar el filtro exacto.
+    Supone que los campos no traen saltos de línea dentro de comillas.
+    """
+
+    def __init__(self, raw, tokens, block_size=BLOCK_SIZE, close_raw=False):
+        self._raw = raw
+        self._tokens = [np.frombuffer(t, dtype=np.uint8) for t in tokens]
+        self._block_size = block_size
+        self._close_raw = close_raw
+        self._carry = b''
+        self._out = memoryview(b'')
+        self._eof = False
+        self.lines_in = 0
+        self.lines_out = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._out and not self._eof:
+            self._fill()
+        n = min(len(buffer), len(self._out))
+        buffer[:n] = self._out[:n]
+        self._out = self._out[n:]
+        return n
+
+    def close(self):
+        if self._close_raw and not self.closed:
+            self._raw.close()
+        super().close()
+
+    def _fill(self):
+        block = self._raw.read(self._block_size)
+        if block:
+            data = self._carry + block
+            cut = data.rfind(b'\n') + 1
+            data, self._carry = data[:cut], data[cut:]
+        else:
+            self._eof = True
+            data, self._carry = self._carry, b''
+            if data and not data.endswith(b'\n'):
+                data += b'\n'
+        if data:
+            self._out = memoryview(self._select(data))
+
+    def _select(self, data):
+        arr = np.frombuffer(data, dtype=np.uint8)
+        folded = np.frombuffer(data.translate(_FOLD), dtype=np.uint8)
+        ends = np.flatnonzero(arr == ord('\n'))
+
+        hits = []
+        for token in self._tokens:
+            span = len(arr) - len(token) + 1
+            if span <= 0:
+                continue
+            # un pase completo por el primer byte; los siguientes solo sobre los candidatos
+            candidates = np.flatnonzero(folded[:span] == token[0])
+            for j in range(1, len(token)):
+                candidates = candidates[folded[candidates + j] == token[j]]
+            hits.append(candidates)
+
+        keep = np.zeros(len(ends), dtype=bool)
+        if hits:
+            keep[np.searchsorted(ends, np.concatenate(hits))] = True
+        self.lines_in += len(ends)
+        self.lines_out += int(keep.sum())
+        return arr[np.repeat(keep, np.diff(ends, prepend=-1))].tobytes()
+
+
+def open_prefiltered(source, tokens, block_size=BLOCK_SIZE):
+    """`source` es una ruta o un archivo binario abierto; regresa un archivo binario filtrado."""
+    if isinstance(source, (str, Path)):
+        raw = PrefilteredReader(open(source, 'rb'), tokens, block_size, close_raw=True)
+    else:
+        raw = PrefilteredReader(source, tokens, block_size)
+    return io.BufferedReader(raw, buffer_size=1024 * 1024)
@@ -0,0 +1,75 @@
+"""Política de reintentos y detección de transferencias estancadas"""
+
+import time
+import random
+import threading
+from dataclasses import dataclass, field
+
+
+class StallError(IOError):
+    """La transferencia cayó por debajo del throughput mínimo."""
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Reintentos acotados para descargas.
+    `min_throughput` (bytes/s) medido sobre ventanas de `stall_window` segundos;
+    0 desactiva el detector.
+    """
+    max_attempts: int = 5
+    backoff_base: float = 1.0
+    backoff_max: float = 60.0
+    jitter: float = 0.5
+    connect_timeout: float = 10.0
+    read_timeout: float = 60.0
+    min_throughput: int = 32 * 1024
+    stall_window: float = 30.0
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def delay(self, attempt):
+        """Backoff exponencial con jitter para el intento `attempt` (1, 2, ...)."""
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        return delay + random.uniform(0, self.jitter * delay)
+
+    def stall_detector(self):
+        return StallDetector(self.min_throughput, self.stall_window)
+
+
+class StallDetector:
+    def __init__(self, min_throughput, window):
+        self.min_throughput = min_throughput
+        self.window = window
+        self._start = time.monotonic()
+        self._bytes = 0
+
+    def update(self, nbytes):
+        if not self.min_throughput:
+            return
+        self._bytes += nbytes
+        elapsed = time.monotonic() - self._start
+        if elapsed < self.window:
+            return
+        rate = self._bytes / elapsed
+        if rate < self.min_throughput:
+            raise StallError(f'{rate / 1024:.1f} KiB/s over {elapsed:.0f}s, below {self.min_throughput / 1024:.0f} KiB/s')
+        self._start, self._bytes = time.monotonic(), 0
+
+
+@dataclass
+class TransferStats:
+    """Intentos y bytes descartados de una descarga; seguro entre hilos."""
+    attempts: int = 0
+    wasted_bytes: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def waste(self, nbytes):
+        if nbytes > 0:
+            with self._lock:
+                self.wasted_bytes += nbytes
+
+    def as_dict(self):
+        return {'attempts': self.attempts, 'wasted_bytes': self.wasted_bytes}
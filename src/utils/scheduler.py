@@ -0,0 +1,46 @@
+"""Gobernador global de concurrencia para la extracción"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+DEFAULT_IO_WORKERS = 2
+DEFAULT_CPU_WORKERS = os.cpu_count() or 1
+
+
+class Governor:
+    """
+    Dos presupuestos fijos para todo el proceso, sin importar cuántos años se procesen:
+    - io: trabajo limitado por disco (extracción de RAR, copias, borrado).
+    - cpu: parseo y filtrado de CSV; hilos, procesos o un solo worker ('serial').
+    """
+
+    def __init__(self, io_workers=DEFAULT_IO_WORKERS, cpu_workers=DEFAULT_CPU_WORKERS, backend='thread'):
+        self.backend = backend
+        self.io_workers = max(1, io_workers)
+        self.cpu_workers = 1 if backend == 'serial' else max(1, min(cpu_workers, DEFAULT_CPU_WORKERS))
+
+        self.io = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='qqp-io')
+        if backend == 'process':
+            self.cpu = ProcessPoolExecutor(max_workers=self.cpu_workers)
+        else:
+            self.cpu = ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix='qqp-cpu')
+
+    def submit_io(self, fn, *args, **kwargs):
+        return self.io.submit(fn, *args, **kwargs)
+
+    def submit_cpu(self, fn, *args, **kwargs):
+        return self.cpu.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self.io.shutdown(wait=wait)
+        self.cpu.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
+
+    def __repr__(self):
+        return f'Governor(io={self.io_workers}, cpu={self.cpu_workers}, backend={self.backend!r})'
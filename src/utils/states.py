@@ -0,0 +1,88 @@
+"""Nombres y claves de las entidades federativas tal como aparecen en QQP"""
+
+import re
+import unicodedata
+
+# clave -> variantes del nombre (sin acentos, en mayúsculas); la primera es la canónica
+STATES = {
+    'AGS': ['AGUASCALIENTES'],
+    'BC': ['BAJA CALIFORNIA'],
+    'BCS': ['BAJA CALIFORNIA SUR'],
+    'CAMP': ['CAMPECHE'],
+    'CHIS': ['CHIAPAS'],
+    'CHIH': ['CHIHUAHUA'],
+    'CDMX': ['CIUDAD DE MEXICO', 'DISTRITO FEDERAL'],
+    'COAH': ['COAHUILA DE ZARAGOZA', 'COAHUILA'],
+    'COL': ['COLIMA'],
+    'DGO': ['DURANGO'],
+    'GTO': ['GUANAJUATO'],
+    'GRO': ['GUERRERO'],
+    'HGO': ['HIDALGO'],
+    'JAL': ['JALISCO'],
+    'MEX': ['ESTADO DE MEXICO', 'MEXICO'],
+    'MICH': ['MICHOACAN DE OCAMPO', 'MICHOACAN'],
+    'MOR': ['MORELOS'],
+    'NAY': ['NAYARIT'],
+    'NL': ['NUEVO LEON'],
+    'OAX': ['OAXACA'],
+    'PUE': ['PUEBLA'],
+    'QRO': ['QUERETARO', 'QUERETARO DE ARTEAGA'],
+    'QROO': ['QUINTANA ROO'],
+    'SLP': ['SAN LUIS POTOSI'],
+    'SIN': ['SINALOA'],
+    'SON': ['SONORA'],
+    'TAB': ['TABASCO'],
+    'TAMS': ['TAMAULIPAS'],
+    'TLAX': ['TLAXCALA'],
+    'VER': ['VERACRUZ DE IGNACIO DE LA LLAVE', 'VERACRUZ'],
+    'YUC': ['YUCATAN'],
+    'ZAC': ['ZACATECAS'],
+}
+_BY_NAME = {name: code for code, names in STATES.items() for name in names}
+
+
+def normalize_state(name):
+    """'Nuevo León ' -> 'NUEVO LEON'"""
+    text = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode()
+    return re.sub(r'\s+', ' ', text).strip().upper()
+
+
+def state_code(name):
+    """Clave corta de un nombre o clave ('Sonora' -> 'SON'); si no se conoce, el nombre como slug."""
+    norm = normalize_state(name)
+    if norm in STATES:
+        return norm
+    return _BY_NAME.get(norm) or re.sub(r'[^A-Z0-9]+', '_', norm).strip('_')
+
+
+def state_slug(code):
+    """Nombre para carpetas legibles: 'SON' -> 'sonora', 'NL' -> 'nuevo_leon'."""
+    name = STATES[code][0] if code in STATES else code
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+def resolve_states(spec):
+    """
+    `spec`: nombres o claves de estados, o 'all'. Regresa un frozenset de claves,
+    o None para todos los estados.
+    """
+    if spec is None or isinstance(spec, str) and spec.lower() == 'all':
+        return None
+    if isinstance(spec, str):
+        spec = [spec]
+    if any(str(s).lower() == 'all' for s in spec):
+        return None
+    return frozenset(state_code(s) for s in spec)
+
+
+def state_tokens(codes):
+    """
+    Bytes que toda línea de los estados `codes` contiene (nombres en mayúsculas, sin acentos).
+    None si no se puede acotar: todos los estados o alguno fuera de la tabla.
+    """
+    if codes is None or any(code not in STATES for code in codes):
+        return None
+    names = {name for code in codes for name in STATES[code]}
+    # 'MEXICO' ya cubre 'ESTADO DE MEXICO'; basta el más corto
+    names = {n for n in names if not any(o != n and o in n for o in names)}
+    return sorted(n.encode('ascii') for n in names)
@@ -0,0 +1,105 @@
+"""Etapa de escritura: un hilo escritor por archivo de salida, alimentado por una cola acotada"""
+
+import queue
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+QUEUE_CHUNKS = 8               # chunks en espera por salida antes de frenar a los productores
+BATCH_ROWS = 100_000           # filas que se juntan antes de cada escritura
+WRITE_BUFFER = 4 * 1024 * 1024
+
+_STOP = object()
+_writers = {}
+_closing = {}
+_writers_lock = threading.Lock()
+
+
+class QueuedCsvWriter:
+    """
+    Único dueño de `path`: los productores hacen `put(df)` y un hilo concatena y escribe
+    lotes grandes con un solo encabezado y sin índice. La cola acotada da contrapresión:
+    si el disco va lento, `put` bloquea en lugar de acumular chunks en memoria.
+    """
+
+    def __init__(self, path, maxsize=QUEUE_CHUNKS, batch_rows=BATCH_ROWS):
+        self.path = Path(path)
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._run, name=f'writer-{self.path.name}', daemon=True)
+        self._thread.start()
+
+    def put(self, df):
+        if self.error:
+            raise self.error
+        self._queue.put(df)
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+        if self.error:
+            raise self.error
+
+    def _run(self):
+        batch, batch_rows = [], 0
+        try:
+            # encabezado solo si el archivo es nuevo; una corrida posterior anexa debajo
+            header = not self.path.exists() or self.path.stat().st_size == 0
+            with open(self.path, 'a', encoding='utf-8', newline='', buffering=WRITE_BUFFER) as f:
+                while (df := self._queue.get()) is not _STOP:
+                    batch.append(df)
+                    batch_rows += len(df)
+                    if batch_rows >= self.batch_rows:
+                        self._write(f, batch, header)
+                        batch, batch_rows, header = [], 0, False
+                if batch:
+                    self._write(f, batch, header)
+        except Exception as e:
+            self.error = e
+            # vaciar la cola para que ningún productor se quede bloqueado en `put`
+            while self._queue.get() is not _STOP:
+                pass
+
+    def _write(self, f, batch, header):
+        df = batch[0] if len(batch) == 1 else pd.concat(batch, ignore_index=True)
+        df.to_csv(f, header=header, index=False)
+        self.rows += len(df)
+
+
+def acquire_writer(path):
+    """El escritor de `path`, compartido por todos los hilos que escriben ahí."""
+    path = Path(path).resolve()
+    while True:
+        with _writers_lock:
+            closing = _closing.get(path)
+            if closing is None:
+                entry = _writers.get(path)
+                if entry is None:
+                    entry = _writers[path] = [QueuedCsvWriter(path), 0]
+                entry[1] += 1
+                return entry[0]
+        # nunca dos escritores sobre el mismo archivo: esperar a que el anterior termine
+        closing._thread.join()
+
+
+def release_writer(writer):
+    """El último en soltarlo vacía la cola y cierra el archivo; los errores de escritura suben aquí."""
+    with _writers_lock:
+        entry = _writers[writer.path]
+        entry[1] -= 1
+        last = entry[1] == 0
+        if last:
+            del _writers[writer.path]
+            _closing[writer.path] = writer
+    if not last:
+        if writer.error:
+            raise writer.error
+        return
+    try:
+        writer.close()
+    finally:
+        with _writers_lock:
+            _closing.pop(writer.path, None)
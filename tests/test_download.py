@@ -0,0 +1,234 @@
+"""Descarga por segmentos y reanudación contra un servidor HTTP local que respeta Range"""
+
+import re
+import random
+import asyncio
+import threading
+import http.server
+from hashlib import md5
+
+import pytest
+import requests
+
+from src import download
+from src.utils.retry import RetryPolicy
+
+POLICY = RetryPolicy(max_attempts=3, backoff_base=0.01, jitter=0, min_throughput=0)
+
+
+def rar_bytes(size, seed):
+    return b"Rar!\x1a\x07\x00" + random.Random(seed).randbytes(size - 7)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Sirve `server.data` con ETag, Range (bytes=a-b y bytes=a-) e If-Range. Con `server.cut`
+    la siguiente respuesta GET se corta tras ese número de bytes; `server.replace` cambia el
+    archivo (datos, etag) justo después del corte, como un archivo que se actualizó en el servidor;
+    `server.fail_resume` es el estado de error con el que responde la siguiente petición con Range.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve()
+
+    def _serve(self, head=False):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, dict(self.headers)))
+            data, etag = server.data, server.etag
+            cut = fail = None
+            if not head and server.cut is not None:
+                cut, server.cut = server.cut, None
+            if not head and 'Range' in self.headers and server.fail_resume:
+                fail, server.fail_resume = server.fail_resume, None
+
+        if fail:
+            self.send_response(fail)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, end, status = 0, len(data) - 1, 200
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and self.headers.get('If-Range', etag) == etag:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            status = 206
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+        body = data[start:end + 1]
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        self.end_headers()
+        if head:
+            return
+        if cut is None:
+            self.wfile.write(body)
+            return
+
+        self.wfile.write(body[:cut])
+        self.wfile.flush()
+        with server.lock:
+            if server.replace:
+                (server.data, server.etag), server.replace = server.replace, None
+        self.connection.shutdown(2)
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.data, httpd.etag = rar_bytes(1024 * 1024, 7), '"v1"'
+    httpd.cut = httpd.replace = httpd.fail_resume = None
+    httpd.url = f'http://127.0.0.1:{httpd.server_address[1]}/QQP_2024.rar'
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def raw(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, 'BASE', tmp_path)
+    monkeypatch.setattr(download, 'RAW', tmp_path / 'raw')
+    (tmp_path / 'raw').mkdir()
+    return tmp_path / 'raw'
+
+
+def gets(server):
+    return [headers for method, headers in server.requests if method == 'GET']
+
+
+def fetch(server, raw, segments=1):
+    with requests.Session() as session:
+        return download.download_file(server.url, raw, segments=segments, session=session, policy=POLICY)
+
+
+def test_segments_download_four_ranges(server, raw):
+    file_path = fetch(server, raw, segments=4)
+
+    assert file_path.read_bytes() == server.data
+    ranges = sorted(h['Range'] for h in gets(server))
+    size = len(server.data)
+    assert ranges == sorted(f'bytes={a}-{b}' for a, b in download._split_ranges(size, 4))
+    assert all(h['If-Range'] == '"v1"' for h in gets(server))
+
+    metadata = download.download_manifest().get('url', server.url)
+    assert metadata['hash'] == md5(server.data).hexdigest()
+    assert metadata['attempts'] == 1 and metadata['wasted_bytes'] == 0
+    assert not list(raw.glob(f'*{download.PART_SUFFIX}*'))
+
+
+def test_stream_resumes_after_cut(server, raw):
+    cut = server.cut = 300 * 1024
+
+    file_path = fetch(server, raw)
+
+    assert file_path.read_bytes() == server.data
+    first, second = gets(server)
+    assert 'Range' not in first
+    offset = int(re.fullmatch(r'bytes=(\d+)-', second['Range']).group(1))
+    assert 0 < offset <= cut and second['If-Range'] == '"v1"'
+    metadata = download.download_manifest().get('url', server.url)
+    assert metadata['attempts'] == 2 and metadata['wasted_bytes'] == 0
+
+
+def test_segments_resume_after_cut(server, raw):
+    server.cut = 100 * 1024
+
+    file_path = fetch(server, raw, segments=4)
+
+    assert file_path.read_bytes() == server.data
+    # el segundo intento solo vuelve a pedir el segmento cortado
+    requests_made = gets(server)
+    assert len(requests_made) == 5
+    assert requests_made[-1]['Range'] == requests_made[0]['Range']
+    assert download.download_manifest().get('url', server.url)['attempts'] == 2
+
+
+def test_async_segments_resume_after_cut(server, raw, monkeypatch):
+    download_async = pytest.importorskip('src.download_async')
+    monkeypatch.setattr(download_async, 'BASE', raw.parent)
+    server.cut = 100 * 1024
+
+    async def fetch_async():
+        async with download_async.aiohttp.ClientSession() as session:
+            return await download_async.download_file_async(
+                session, asyncio.Semaphore(8), server.url, raw, segments=4, policy=POLICY
+            )
+
+    file_path = asyncio.run(fetch_async())
+
+    assert file_path.read_bytes() == server.data
+    requests_made = gets(server)
+    # el segundo intento no vuelve a pedir los segmentos que terminaron
+    assert requests_made[-1]['Range'] in {h['Range'] for h in requests_made[:4]}
+    assert len(requests_made) <= 8
+    metadata = download.download_manifest().get('url', server.url)
+    assert metadata['attempts'] == 2 and metadata['hash'] == md5(server.data).hexdigest()
+    assert not list(raw.glob(f'*{download.PART_SUFFIX}*'))
+
+
+def test_if_range_restarts_when_file_changed(server, raw):
+    new = rar_bytes(1024 * 1024, 11)
+    cut = server.cut = 300 * 1024
+    server.replace = (new, '"v2"')
+
+    file_path = fetch(server, raw)
+
+    assert file_path.read_bytes() == new
+    first, second = gets(server)
+    assert second['If-Range'] == '"v1"'
+    metadata = download.download_manifest().get('url', server.url)
+    # el parcial de la versión vieja se descartó completo
+    assert metadata['etag'] == '"v2"' and metadata['hash'] == md5(new).hexdigest()
+    assert 0 < metadata['wasted_bytes'] <= cut
+
+
+def test_resume_error_keeps_partial(server, raw):
+    cut = server.cut = 300 * 1024
+    server.fail_resume = 503
+
+    file_path = fetch(server, raw)
+
+    assert file_path.read_bytes() == server.data
+    first, failed, resumed = gets(server)
+    assert failed['Range'] == resumed['Range'] and int(resumed['Range'][6:-1]) <= cut
+    metadata = download.download_manifest().get('url', server.url)
+    # el 503 no descartó el parcial
+    assert metadata['attempts'] == 3 and metadata['wasted_bytes'] == 0
+
+
+def test_complete_partial_answered_416(server, raw):
+    part_path, sidecar_path = download._partial_paths(server.url, raw)
+    part_path.write_bytes(server.data)
+    download._write_sidecar(sidecar_path, {
+        'url': server.url, 'bytes_written': len(server.data),
+        'hash': md5(server.data).hexdigest(), 'validator': '"v1"',
+    })
+
+    file_path = fetch(server, raw)
+
+    assert file_path.read_bytes() == server.data
+    assert [h['Range'] for h in gets(server)] == [f'bytes={len(server.data)}-']
+    metadata = download.download_manifest().get('url', server.url)
+    assert metadata['hash'] == md5(server.data).hexdigest() and metadata['wasted_bytes'] == 0
@@ -0,0 +1,65 @@
+"""Un CSV partido en rangos de bytes da la misma salida que filtrarlo completo"""
+
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from src import extract
+from src.utils import byterange, dictionaries
+from src.utils.parquet import read_dataset
+
+STATES = ['SONORA', 'SINALOA', 'JALISCO']
+
+
+def national_csv(path, n, seed):
+    """`n` líneas al estilo del CSV nacional; el último cuarto repite llaves del primero con otra ubicación."""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(n):
+        lines.append([f'PROD {i % 40}', f'PRES {i % 7}', f'MARCA {i % 13}', f'CAT {i % 5}', 'BASICOS',
+                      f'{rnd.uniform(1, 500):.2f}', f'2024-{1 + i % 12:02d}-{1 + i % 28:02d}', f'CADENA {i % 9}',
+                      'SUPERMERCADO', f'TIENDA {i % 31}', f'"CALLE {i}, CENTRO"', rnd.choice(STATES),
+                      f'MUN {i % 6}', f'{rnd.uniform(14, 32):.6f}', f'{rnd.uniform(-117, -86):.6f}'])
+    for line in rnd.sample(lines[:n // 4], n // 4):
+        lines.append(line[:13] + ['20.000000', '-100.000000'])
+    path.write_text(''.join(','.join(line) + '\n' for line in lines), encoding='latin1')
+    return path
+
+
+@pytest.fixture(autouse=True)
+def dictionary_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(dictionaries, 'DICTIONARY_DIR', tmp_path / 'dictionaries')
+
+
+def run(path, output_dir, fmt, workers):
+    options = extract.FilterOptions(output_dir=output_dir, year=2024, shard=True, fmt=fmt)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        job = extract.submit_filter(executor.submit, extract.filter_states_and_save, (path, options), workers)
+        return job, job.result()
+
+
+@pytest.mark.parametrize('fmt', extract.FORMATS)
+def test_ranges_match_whole_member(tmp_path, monkeypatch, fmt):
+    monkeypatch.setattr(extract, 'split_ranges', lambda path, parts: byterange.split_ranges(path, parts, 4096))
+    path = national_csv(tmp_path / 'QQP_2024.csv', 2000, 3)
+    (tmp_path / 'whole').mkdir()
+    (tmp_path / 'split').mkdir()
+
+    _, whole = run(path, tmp_path / 'whole', fmt, 1)
+    job, split = run(path, tmp_path / 'split', fmt, 4)
+
+    assert isinstance(job, extract._RangeJob) and job.parts == 4
+    # las repetidas caen a otro rango que su original: sin dedup entre rangos sobrarían
+    assert whole['duplicates'] > 0
+    assert split['states'] == whole['states'] and split['duplicates'] == whole['duplicates']
+    if fmt == 'csv':
+        name = 'QQP_2024_son/QQP_2024_SON_QQP_2024.csv'
+        assert (tmp_path / 'split' / name).read_bytes() == (tmp_path / 'whole' / name).read_bytes()
+    else:
+        def dataset(root):
+            df = read_dataset(extract.parquet_root('SON', root))
+            return df.astype({c: str for c in df.columns}).sort_values(list(df.columns), ignore_index=True)
+        pd.testing.assert_frame_equal(dataset(tmp_path / 'split'), dataset(tmp_path / 'whole'))
+    assert not list((tmp_path / 'split').glob('.ranges_*'))